@@ -1,17 +1,32 @@
 import requests
-from flask import Flask, jsonify, request, send_file, abort
+from flask import Flask, jsonify, request, send_file, abort, g, has_request_context
 from flask_cors import CORS
 import re
 from datetime import datetime, timezone, timedelta
 import json
+import base64
+import codecs
+import copy
+import math
+import random
+import tempfile
 import pytz
 import demjson3
 import json as pyjson
 import os
-from itertools import product
+from itertools import islice, product
 import time
+import functools
+import hashlib
+import heapq
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import tracemalloc
 import traceback
 import logging
+from collections import OrderedDict
 
 # # print("\n=== Loading Environment Variables ===")
 # Debug: Print all environment variables
@@ -73,13 +88,19 @@ def check_ai_availability():
 @app.route("/api/connapi-status")
 def check_connapi_status():
     try:
-        response = requests.get("https://usis-cdn.eniamza.com/connect.json", timeout=30)
-        response.raise_for_status()  # This will raise an exception for HTTP errors
-        data = response.json()
+        snapshot = _snapshot
+        response = requests.get(DATA_URL, headers=catalog_request_headers(snapshot), timeout=30)
+        if response.status_code == 304 and snapshot is not None:
+            # Catalog unchanged since our snapshot; no body was sent
+            cached = snapshot.cached
+        else:
+            response.raise_for_status()  # This will raise an exception for HTTP errors
+            data = response.json()
+            cached = data.get("cached", True)
         
         return jsonify({
             "status": "online",
-            "cached": data.get("cached", True),
+            "cached": cached,
             "message": "API is online and responding"
         })
     except requests.exceptions.Timeout:
@@ -119,15 +140,15 @@ def test():
 @app.route("/api/courses")
 def get_courses():
     try:
-        data = load_data()  # Load data directly in the route
-        if data is None:
+        records = load_records()  # Load data directly in the route
+        if records is None:
             return jsonify({"error": "Failed to load course data. Please try again later."}), 503
             
         courses_data = {}
-        for section in data:
-            code = section.get("courseCode")
-            name = section.get("courseName", code)
-            available_seats = section.get("capacity", 0) - section.get("consumedSeat", 0)
+        for record in records:
+            code = record.course_code
+            name = record.course_name
+            available_seats = record.available_seats
             if code not in courses_data:
                 courses_data[code] = {
                     "code": code, 
@@ -138,7 +159,7 @@ def get_courses():
             courses_data[code]["totalAvailableSeats"] += available_seats
             # Add section info
             courses_data[code]["sections"].append({
-                "sectionName": section.get("sectionName"),
+                "sectionName": record.section_name,
                 "availableSeats": available_seats
             })
             
@@ -149,14 +170,578 @@ def get_courses():
         return jsonify({"error": "Failed to process courses data. Please try again later."}), 503
 
 
-# Initialize data as None
-data = None
+# Upstream catalog consumed by every data endpoint
+DATA_URL = os.environ.get("CONNECT_DATA_URL", "https://usis-cdn.eniamza.com/connect.json")
+
+# A snapshot younger than the TTL is served as-is. Between the TTL and the
+# maximum staleness it is still served while one background refresh replaces
+# it; past the maximum staleness the request waits for a fresh download.
+SNAPSHOT_TTL_SECONDS = float(os.environ.get("SNAPSHOT_TTL_SECONDS", "60"))
+SNAPSHOT_MAX_STALE_SECONDS = float(os.environ.get("SNAPSHOT_MAX_STALE_SECONDS", "600"))
+
+# A background thread polls upstream on this schedule so request handlers
+# only read the module-level snapshot. Set SNAPSHOT_REFRESHER=0 to disable.
+SNAPSHOT_REFRESH_INTERVAL_SECONDS = float(os.environ.get("SNAPSHOT_REFRESH_INTERVAL_SECONDS", "30"))
+SNAPSHOT_REFRESHER_ENABLED = os.environ.get("SNAPSHOT_REFRESHER", "1") != "0"
+
+# The last good snapshot is persisted here as JSON and loaded on startup, so a
+# cold start can answer before the first download finishes. Point it into a
+# directory only this service can write to; unset or empty disables it.
+SNAPSHOT_CACHE_PATH = os.environ.get("SNAPSHOT_CACHE_PATH", "")
+# Bump whenever the persisted layout changes so old files are ignored
+SNAPSHOT_FILE_FORMAT = 5
+
+# The catalog is parsed while it downloads, this many bytes at a time
+CATALOG_CHUNK_SIZE = 64 * 1024
+# Measure the Python heap during each refresh with tracemalloc (slows it down)
+SNAPSHOT_TRACE_MEMORY = os.environ.get("SNAPSHOT_TRACE_MEMORY", "0") == "1"
+
+# Weekly timetable masks have one bit per 5-minute cell, day by day from
+# Sunday, so two sections clash exactly when their masks intersect
+MASK_GRANULARITY_MINUTES = 5
+MASK_CELLS_PER_DAY = 24 * 60 // MASK_GRANULARITY_MINUTES
+WEEKDAY_INDEX = {
+    day: index
+    for index, day in enumerate(
+        ["SUNDAY", "MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY"]
+    )
+}
+
+
+class SectionRecord:
+    """Compact, pre-parsed view of one catalog section.
+
+    Class and lab meetings are (day, start_min, end_min) tuples with the day
+    upper-cased, and exams are (day_number, start_min, end_min) tuples where
+    day_number is the ordinal of the exam date (None if it cannot be parsed).
+    ``time_mask`` is the weekly occupancy of all meetings as an int bitmask,
+    or None when a meeting does not fit the 5-minute grid or a known day.
+    ``raw`` is the upstream dict, which is still what the API returns.
+    ``shared`` is the intern table for one parse: equal meeting and exam tuples
+    recur across thousands of sections, so records built with the same table
+    share one instance of each, and it is freed with that parse's snapshot."""
+
+    __slots__ = (
+        "section_id",
+        "course_code",
+        "course_name",
+        "section_name",
+        "faculty",
+        "capacity",
+        "consumed_seat",
+        "available_seats",
+        "class_meetings",
+        "lab_meetings",
+        "mid_exam",
+        "final_exam",
+        "time_mask",
+        "internal_conflict",
+        "raw",
+    )
+
+    def __init__(self, section, shared=None):
+        shared = {} if shared is None else shared
+        schedule = section.get("sectionSchedule") or {}
+        class_schedules = schedule.get("classSchedules")
+        self.section_id = section.get("sectionId")
+        self.course_code = section.get("courseCode")
+        self.course_name = section.get("courseName", self.course_code)
+        self.section_name = section.get("sectionName")
+        self.faculty = section.get("faculties")
+        self.capacity = section.get("capacity") or 0
+        self.consumed_seat = section.get("consumedSeat") or 0
+        self.available_seats = self.capacity - self.consumed_seat
+        self.class_meetings = SectionRecord._meetings(
+            class_schedules if isinstance(class_schedules, list) else [], shared
+        )
+        self.lab_meetings = SectionRecord._meetings(get_lab_schedules_flat(section), shared)
+        self.mid_exam = SectionRecord._exam(schedule, "mid", shared)
+        self.final_exam = SectionRecord._exam(schedule, "final", shared)
+        self.time_mask, self.internal_conflict = SectionRecord._mask(self.meetings, shared)
+        self.raw = section
+
+    @staticmethod
+    def _meetings(schedules, shared):
+        share = shared.setdefault
+        meetings = tuple(
+            share(meeting, meeting)
+            for meeting in (
+                (
+                    sched["day"].upper(),
+                    TimeUtils.time_to_minutes(sched.get("startTime") or ""),
+                    TimeUtils.time_to_minutes(sched.get("endTime") or ""),
+                )
+                for sched in schedules
+                if isinstance(sched, dict) and sched.get("day")
+            )
+        )
+        return share(meetings, meetings)
+
+    @staticmethod
+    def _mask(meetings, shared):
+        """Return (time_mask, internal_conflict) for the meetings."""
+        mask = 0
+        internal_conflict = False
+        for meeting in meetings:
+            meeting_mask = meeting_bits(meeting)
+            if meeting_mask is None:
+                return None, meetings_conflict(meetings, meetings, same=True)
+            internal_conflict = internal_conflict or bool(mask & meeting_mask)
+            mask |= meeting_mask
+        return shared.setdefault(mask, mask), internal_conflict
+
+    @staticmethod
+    def _exam(schedule, kind, shared):
+        exam_date = schedule.get(f"{kind}ExamDate")
+        if not exam_date:
+            return None
+        normalized = normalize_date(exam_date)
+        day_number = (
+            datetime.strptime(normalized, "%Y-%m-%d").toordinal() if normalized else None
+        )
+        exam = (
+            day_number,
+            TimeUtils.time_to_minutes(schedule.get(f"{kind}ExamStartTime") or ""),
+            TimeUtils.time_to_minutes(schedule.get(f"{kind}ExamEndTime") or ""),
+        )
+        return shared.setdefault(exam, exam)
+
+    @property
+    def meetings(self):
+        """All class and lab meetings of the section."""
+        return self.class_meetings + self.lab_meetings
+
+
+class CatalogSnapshot:
+    """A versioned, read-only copy of the parsed catalog."""
+
+    def __init__(self, records, version, fetched_at=None, etag=None,
+                 last_modified=None, cached=True):
+        self.records = records
+        # Upstream dicts, in catalog order, for responses that return them
+        self.sections = [record.raw for record in records]
+        self.version = version
+        # Lookup indexes; lists keep catalog order
+        self.by_course = {}
+        self.by_faculty = {}
+        self.by_course_section = {}
+        self.by_id = {}
+        for record in records:
+            self.by_course.setdefault(record.course_code, []).append(record)
+            if record.faculty:
+                self.by_faculty.setdefault(record.faculty, []).append(record)
+            self.by_course_section.setdefault(
+                (record.course_code, str(record.section_name)), []
+            ).append(record)
+            if record.section_id is not None:
+                self.by_id.setdefault(record.section_id, record)
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self._schedule_fingerprint = None
+        # Upstream validators used for conditional requests
+        self.etag = etag
+        self.last_modified = last_modified
+        self.cached = cached
+
+    def schedule_fingerprint(self):
+        """Hash of the section data routine searches use, apart from seat
+        counts, so snapshots that only differ in seats share it."""
+        if self._schedule_fingerprint is None:
+            self._schedule_fingerprint = hash(tuple(
+                (
+                    record.section_id,
+                    record.course_code,
+                    record.section_name,
+                    record.faculty,
+                    record.class_meetings,
+                    record.lab_meetings,
+                    record.mid_exam,
+                    record.final_exam,
+                )
+                for record in self.records
+            ))
+        return self._schedule_fingerprint
+
+    def age(self):
+        """Seconds elapsed since the snapshot was downloaded or revalidated."""
+        return max(0.0, time.time() - self.fetched_at)
+
+    def revalidated(self, etag=None, last_modified=None):
+        """Copy of this snapshot marked fresh, sharing the parsed data."""
+        snapshot = copy.copy(self)
+        snapshot.fetched_at = time.time()
+        snapshot.etag = etag or self.etag
+        snapshot.last_modified = last_modified or self.last_modified
+        return snapshot
+
+
+class SingleFlight:
+    """Run at most one call at a time; callers arriving meanwhile wait for it
+    and share its result instead of starting their own."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._call = None
+        self._waiting = 0
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.max_waiting = 0
+
+    def do(self, fn):
+        with self._lock:
+            self.calls += 1
+            call = self._call
+            leader = call is None
+            if leader:
+                call = self._call = SingleFlight._Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+                self._waiting += 1
+                self.max_waiting = max(self.max_waiting, self._waiting)
+
+        if not leader:
+            call.done.wait()
+            with self._lock:
+                self._waiting -= 1
+            return call.result
+
+        try:
+            call.result = fn()
+        finally:
+            with self._lock:
+                self._call = None
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalescedWaiters": self.coalesced,
+                "waiting": self._waiting,
+                "maxWaiting": self.max_waiting,
+            }
+
+
+class CompatibilityCache:
+    """Bounded LRU of section compatibility, shared by all routine searches.
+
+    An entry is keyed by a section ID and a course code and holds the
+    sections of that course, as bitsets over snapshot.by_course order,
+    that have an exam conflict and a time conflict with the section. All
+    entries belong to one snapshot version: they are dropped when a newer
+    version shows up, and searches still on an older one bypass the cache."""
+
+    def __init__(self, max_size):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_size = max_size
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def invalidate(self, version):
+        """Drop every entry if ``version`` is newer than the cached one."""
+        with self._lock:
+            self._invalidate(version)
+
+    def _invalidate(self, version):
+        if self.version is None or version > self.version:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self.version = version
+
+    def conflicts(self, snapshot, record, course_code):
+        """Return (exam conflicts, time conflicts) of ``record`` with the sections of ``course_code``.
+
+        Entries are keyed by section ID, so a record that is not the one
+        snapshot.by_id holds for its ID (a duplicate or missing ID) bypasses
+        the cache rather than share another section's entry."""
+        key = (record.section_id, course_code)
+        cacheable = snapshot.by_id.get(record.section_id) is record
+        with self._lock:
+            self._invalidate(snapshot.version)
+            entry = (
+                self._entries.get(key)
+                if cacheable and snapshot.version == self.version
+                else None
+            )
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry
+            self.misses += 1
+        exam_bits = time_bits = 0
+        for position, other in enumerate(snapshot.by_course.get(course_code, ())):
+            if records_exam_conflict(record, other):
+                exam_bits |= 1 << position
+            if records_time_conflict(record, other):
+                time_bits |= 1 << position
+        entry = (exam_bits, time_bits)
+        with self._lock:
+            if cacheable and snapshot.version == self.version and self.max_size > 0:
+                self._entries[key] = entry
+                if len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class RoutineCache:
+    """Bounded LRU of /api/routine results, keyed by routine_cache_key().
+
+    Routines are kept as section IDs. They are only served again while
+    every section in them still has seats in the current snapshot;
+    otherwise the entry is dropped and counted as stale."""
+
+    def __init__(self, max_size):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, key, positions, snapshot):
+        """Return (best combination, ranked or None, search stats), or None.
+
+        ``positions[i]`` is the place of the request's i-th course in the
+        canonical order the routines are stored in."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        routines, scores, search_stats = entry
+        combinations = []
+        for section_ids in routines:
+            records = [snapshot.by_id.get(section_id) for section_id in section_ids]
+            if any(record is None or record.available_seats <= 0 for record in records):
+                with self._lock:
+                    self.stale += 1
+                    self.misses += 1
+                    self._entries.pop(key, None)
+                return None
+            combinations.append(tuple(records[position] for position in positions))
+        with self._lock:
+            self.hits += 1
+        if scores is None:
+            return combinations[0], None, search_stats
+        ranked = list(zip(scores, combinations))
+        return combinations[0], ranked, search_stats
+
+    def put(self, key, positions, snapshot, best_combination, ranked, search_stats):
+        if self.max_size <= 0:
+            return
+        if ranked is None:
+            combinations, scores = [best_combination], None
+        else:
+            combinations = [combination for _, combination in ranked]
+            scores = [score for score, _ in ranked]
+        routines = []
+        for combination in combinations:
+            section_ids = [None] * len(combination)
+            for position, record in zip(positions, combination):
+                # Sections that cannot be found again by ID are not cached
+                if record.section_id is None or snapshot.by_id.get(record.section_id) is not record:
+                    return
+                section_ids[position] = record.section_id
+            routines.append(tuple(section_ids))
+        with self._lock:
+            self._entries[key] = (routines, scores, search_stats)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+            }
+
+
+_snapshot = None
+_snapshot_version = 0
+_snapshot_lock = threading.Lock()
+_background_refresh_running = False
+_refresher_thread = None
+_refresh_stats = {
+    "lastSuccess": None,
+    "lastFailure": None,
+    "consecutiveFailures": 0,
+    "lastParse": None,
+}
+# Coalesces concurrent catalog downloads into one
+_catalog_flight = SingleFlight()
+# Section compatibility rows kept across routine requests
+COMPATIBILITY_CACHE_SIZE = int(os.environ.get("COMPATIBILITY_CACHE_SIZE", "20000"))
+_compatibility_cache = CompatibilityCache(COMPATIBILITY_CACHE_SIZE)
+# Results of recent /api/routine requests
+ROUTINE_CACHE_SIZE = int(os.environ.get("ROUTINE_CACHE_SIZE", "1000"))
+_routine_cache = RoutineCache(ROUTINE_CACHE_SIZE)
+
+
+# Returned by fetch_catalog() in place of the records when upstream answers
+# 304 Not Modified
+CATALOG_NOT_MODIFIED = object()
+
+# Brotli is only advertised when a decoder is installed for urllib3 to use
+try:
+    import brotli  # noqa: F401
+    CATALOG_ACCEPT_ENCODING = "br, gzip, deflate"
+except ImportError:
+    CATALOG_ACCEPT_ENCODING = "gzip, deflate"
+
+
+def catalog_request_headers(snapshot=None):
+    """Request headers for connect.json, conditional on the given snapshot."""
+    headers = {"Accept-Encoding": CATALOG_ACCEPT_ENCODING}
+    if snapshot is not None:
+        if snapshot.etag:
+            headers["If-None-Match"] = snapshot.etag
+        if snapshot.last_modified:
+            headers["If-Modified-Since"] = snapshot.last_modified
+    return headers
+
+
+class CatalogStream:
+    """Incremental parser for connect.json.
+
+    Reads the response body chunk by chunk and yields the entries of the
+    top-level "data" array one at a time, so the raw body and the full
+    decoded document never have to be held in memory together. Every other
+    top-level key is collected into ``metadata``."""
+
+    _WHITESPACE = " \t\n\r"
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decode_text = codecs.getincrementaldecoder("utf-8")()
+        self._decode_json = json.JSONDecoder().raw_decode
+        self._buffer = ""
+        self._pos = 0
+        self._exhausted = False
+        self.metadata = {}
+        self.bytes_read = 0
+        self.peak_buffer = 0
+
+    def _fill(self):
+        """Append the next chunk to the buffer; False once the body is exhausted."""
+        if self._exhausted:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._exhausted = True
+            text = self._decode_text.decode(b"", final=True)
+        else:
+            self.bytes_read += len(chunk)
+            text = self._decode_text.decode(chunk)
+        # Drop what has already been parsed before growing the buffer
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        self.peak_buffer = max(self.peak_buffer, len(self._buffer))
+        return True
+
+    def _peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            buffer = self._buffer
+            pos = self._pos
+            while pos < len(buffer) and buffer[pos] in self._WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of catalog data")
+
+    def _expect(self, *chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(f"Unexpected {char!r} in catalog data")
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decode one complete JSON value, reading more data as needed."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decode_json(self._buffer, self._pos)
+                # A value that ends exactly at the buffer edge may be a
+                # truncated number or literal, so only trust it at EOF
+                if end < len(self._buffer) or self._exhausted:
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._exhausted:
+                    raise
+            self._fill()
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            raise ValueError("Catalog has no 'data' key")
+        seen_data = False
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "data":
+                seen_data = True
+                self._expect("[")
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(",", "]") == "]":
+                            break
+            else:
+                self.metadata[key] = self._value()
+            if self._expect(",", "}") == "}":
+                break
+        if not seen_data:
+            raise ValueError("Catalog has no 'data' key")
+
+
+def fetch_catalog(snapshot=None):
+    """Download connect.json.
 
-def load_data():
+    When a snapshot is given the request is conditional on its validators.
+    Returns a (records, metadata) tuple, where records is
+    CATALOG_NOT_MODIFIED if upstream reports no change, or None on failure.
+    metadata holds the response's validators either way."""
     try:
-        DATA_URL = "https://usis-cdn.eniamza.com/connect.json"
-        # print(f"\nLoading fresh data from {DATA_URL}...")
-        
         # Add retry logic
         max_retries = 3
         retry_delay = 2  # seconds
@@ -164,25 +749,33 @@ def load_data():
         for attempt in range(max_retries):
             try:
                 # print(f"Attempt {attempt + 1}/{max_retries}...")
-                response = requests.get(DATA_URL, timeout=30)  # Increased timeout
-                response.raise_for_status()
-                raw_json = response.json()
-                
-                # Use only the 'data' key from the response
-                if isinstance(raw_json, dict) and "data" in raw_json:
-                    fresh_data = raw_json["data"]
-                else:
-                    # print(f"Warning: Expected dict with 'data' key, got {type(raw_json)}")
-                    continue
-                
-                if not isinstance(fresh_data, list):
-                    # print(f"Warning: Expected list data, got {type(fresh_data)}")
-                    continue
-                
-                # print(f"Successfully loaded {len(fresh_data)} sections")
-                return fresh_data
+                with requests.get(
+                    DATA_URL,
+                    headers=catalog_request_headers(snapshot),
+                    timeout=30,
+                    stream=True,
+                ) as response:
+                    if response.status_code == 304 and snapshot is not None:
+                        # A 304 may carry updated validators for the same body
+                        return CATALOG_NOT_MODIFIED, {
+                            "etag": response.headers.get("ETag"),
+                            "last_modified": response.headers.get("Last-Modified"),
+                        }
+                    response.raise_for_status()
+                    records, parse_stats, metadata = _parse_catalog_stream(
+                        response.iter_content(chunk_size=CATALOG_CHUNK_SIZE)
+                    )
+
+                # print(f"Successfully loaded {len(records)} sections")
+                with _snapshot_lock:
+                    _refresh_stats["lastParse"] = parse_stats
+                return records, {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "cached": metadata.get("cached", True),
+                }
                 
-            except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            except (requests.exceptions.RequestException, ValueError) as e:
                 # print(f"Error on attempt {attempt + 1}: {e}")
                 if attempt < max_retries - 1:
                     # print(f"Retrying in {retry_delay} seconds...")
@@ -193,13 +786,350 @@ def load_data():
         return None
         
     except Exception as e:
-        # print(f"Critical error in load_data: {e}")
+        # print(f"Critical error in fetch_catalog: {e}")
+        return None
+
+
+def _share_strings(value, memo):
+    """Rebuild a decoded JSON value so equal keys and short strings are shared.
+
+    Each section is decoded separately, so unlike a single json.loads() the
+    decoder cannot reuse key strings across sections; sharing them (and the
+    many repeated day, time and date values) keeps the store compact."""
+    if isinstance(value, dict):
+        return {memo.setdefault(k, k): _share_strings(v, memo) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_share_strings(v, memo) for v in value]
+    if isinstance(value, str) and len(value) <= 32:
+        return memo.setdefault(value, value)
+    return value
+
+
+def _parse_catalog_stream(chunks):
+    """Build the section records from a streamed catalog body.
+
+    Returns (records, parse_stats, metadata). Each section is converted to a
+    SectionRecord as soon as it is decoded; parse_stats records the download size and the
+    largest amount of undecoded text held at once, plus the traced heap peak
+    and final store size when SNAPSHOT_TRACE_MEMORY is enabled."""
+    tracing = SNAPSHOT_TRACE_MEMORY
+    started_tracing = False
+    if tracing:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+    try:
+        stream = CatalogStream(chunks)
+        records = []
+        # Interns strings and the records' tuples for this parse only, so
+        # nothing outlives the snapshot built from it
+        memo = {}
+        for section in stream:
+            if isinstance(section, dict):
+                records.append(SectionRecord(_share_strings(section, memo), memo))
+
+        parse_stats = {
+            "sections": len(records),
+            "bytesRead": stream.bytes_read,
+            "peakBufferChars": stream.peak_buffer,
+        }
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            parse_stats["tracedStoreBytes"] = current - baseline
+            parse_stats["tracedPeakBytes"] = peak - baseline
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return records, parse_stats, stream.metadata
+
+
+def refresh_snapshot():
+    """Download the catalog and swap it in as the current snapshot.
+
+    Concurrent callers share a single download. Returns the new snapshot, or
+    None if the download failed (the previous snapshot is left untouched in
+    that case)."""
+    return _catalog_flight.do(_refresh_snapshot_once)
+
+
+def _refresh_snapshot_once():
+    global _snapshot, _snapshot_version
+    previous = _snapshot
+    result = fetch_catalog(previous)
+    with _snapshot_lock:
+        if result is None:
+            _refresh_stats["lastFailure"] = time.time()
+            _refresh_stats["consecutiveFailures"] += 1
+            return None
+        _refresh_stats["lastSuccess"] = time.time()
+        _refresh_stats["consecutiveFailures"] = 0
+        records, metadata = result
+        if records is CATALOG_NOT_MODIFIED:
+            # Same catalog: keep the parsed data and version, reset the age
+            # and take any validators the 304 sent
+            _snapshot = previous.revalidated(metadata["etag"], metadata["last_modified"])
+            snapshot = _snapshot
+        else:
+            _snapshot_version += 1
+            _compatibility_cache.invalidate(_snapshot_version)
+            _snapshot = CatalogSnapshot(
+                records,
+                _snapshot_version,
+                etag=metadata["etag"],
+                last_modified=metadata["last_modified"],
+                cached=metadata["cached"],
+            )
+            snapshot = _snapshot
+    # A revalidated snapshot is saved too, so a cold start sees its new age
+    save_snapshot(snapshot)
+    return snapshot
+
+
+def save_snapshot(snapshot, path=None):
+    """Persist a snapshot to disk, replacing the previous file atomically."""
+    path = SNAPSHOT_CACHE_PATH if path is None else path
+    if not path:
+        return False
+    payload = {
+        "format": SNAPSHOT_FILE_FORMAT,
+        "version": snapshot.version,
+        "fetched_at": snapshot.fetched_at,
+        "etag": snapshot.etag,
+        "last_modified": snapshot.last_modified,
+        "cached": snapshot.cached,
+        "sections": snapshot.sections,
+    }
+    tmp_path = None
+    try:
+        # mkstemp creates a new file with O_EXCL, so a planted symlink is never followed
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".routinez-snapshot-", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path))
+        )
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        # print(f"Error persisting snapshot: {e}")
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return False
+
+
+def load_persisted_snapshot(path=None):
+    """Read a snapshot saved by save_snapshot(), or None if there is no usable file.
+
+    The file holds plain JSON, so the records are rebuilt from the saved sections."""
+    path = SNAPSHOT_CACHE_PATH if path is None else path
+    if not path:
         return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if not isinstance(payload, dict) or payload.get("format") != SNAPSHOT_FILE_FORMAT:
+            return None
+        memo = {}
+        records = [
+            SectionRecord(_share_strings(section, memo), memo)
+            for section in payload["sections"]
+            if isinstance(section, dict)
+        ]
+        return CatalogSnapshot(
+            records,
+            payload["version"],
+            fetched_at=payload["fetched_at"],
+            etag=payload["etag"],
+            last_modified=payload["last_modified"],
+            cached=payload["cached"],
+        )
+    except Exception as e:
+        # print(f"Error loading persisted snapshot: {e}")
+        return None
+
+
+def restore_snapshot():
+    """Install the persisted snapshot as the current one if nothing is loaded yet.
+
+    It keeps its original download time, so its age is reported honestly and
+    the next refresh revalidates it with its stored validators."""
+    global _snapshot, _snapshot_version
+    snapshot = load_persisted_snapshot()
+    if snapshot is None:
+        return None
+    with _snapshot_lock:
+        if _snapshot is not None:
+            return _snapshot
+        _snapshot_version = max(_snapshot_version, snapshot.version)
+        _snapshot = snapshot
+        return snapshot
+
+
+def _background_refresh():
+    global _background_refresh_running
+    try:
+        refresh_snapshot()
+    finally:
+        with _snapshot_lock:
+            _background_refresh_running = False
+
+
+def _start_background_refresh():
+    """Start a refresh thread unless one is already running."""
+    global _background_refresh_running
+    with _snapshot_lock:
+        if _background_refresh_running:
+            return
+        _background_refresh_running = True
+    threading.Thread(target=_background_refresh, daemon=True).start()
+
+
+def _refresher_loop():
+    while True:
+        try:
+            refresh_snapshot()
+        except Exception:
+            # A failed refresh keeps the previous snapshot; try again next tick
+            pass
+        time.sleep(SNAPSHOT_REFRESH_INTERVAL_SECONDS)
+
+
+def refresher_running():
+    return _refresher_thread is not None and _refresher_thread.is_alive()
+
+
+def start_snapshot_refresher():
+    """Start the background thread that keeps the snapshot up to date."""
+    global _refresher_thread
+    with _snapshot_lock:
+        if refresher_running():
+            return
+        _refresher_thread = threading.Thread(
+            target=_refresher_loop, name="snapshot-refresher", daemon=True
+        )
+        _refresher_thread.start()
+
+
+def get_snapshot():
+    """Return the catalog snapshot to serve.
+
+    Only a cold start (no snapshot at all) waits for the network. Otherwise
+    the current snapshot is returned immediately and, once past its TTL, a
+    background refresh is started. Without the refresher thread, a snapshot
+    older than SNAPSHOT_MAX_STALE_SECONDS is refreshed before answering but
+    still served if that refresh fails."""
+    snapshot = _snapshot
+    if snapshot is None:
+        return refresh_snapshot()
+    age = snapshot.age()
+    if age < SNAPSHOT_TTL_SECONDS:
+        return snapshot
+    if age < SNAPSHOT_MAX_STALE_SECONDS or refresher_running():
+        # Stale-while-revalidate: answer now, refresh in the background
+        _start_background_refresh()
+        return snapshot
+    return refresh_snapshot() or snapshot
+
+
+def load_snapshot():
+    """Return the current catalog snapshot for this request, or None if unavailable."""
+    snapshot = get_snapshot()
+    if snapshot is not None and has_request_context():
+        # Remembered so the response can report which snapshot it was built from
+        g.snapshot = snapshot
+    return snapshot
+
+
+def load_records():
+    """Return the SectionRecords of the current catalog snapshot, or None if unavailable."""
+    snapshot = load_snapshot()
+    return None if snapshot is None else snapshot.records
+
+
+@app.route("/api/snapshot-status")
+def snapshot_status():
+    snapshot = _snapshot
+    return jsonify({
+        "snapshot": None if snapshot is None else {
+            "version": snapshot.version,
+            "age": round(snapshot.age(), 1),
+            "sections": len(snapshot.sections),
+        },
+        "refresher": {
+            "running": refresher_running(),
+            "interval": SNAPSHOT_REFRESH_INTERVAL_SECONDS,
+            **_refresh_stats,
+        },
+        "singleFlight": _catalog_flight.stats(),
+        "compatibilityCache": _compatibility_cache.stats(),
+        "routineCache": _routine_cache.stats(),
+    })
+
+
+@app.after_request
+def add_snapshot_headers(response):
+    snapshot = g.get("snapshot")
+    if snapshot is not None:
+        response.headers["X-Snapshot-Version"] = str(snapshot.version)
+        response.headers["X-Snapshot-Age"] = f"{snapshot.age():.1f}"
+    return response
+
+
+restore_snapshot()
+if SNAPSHOT_REFRESHER_ENABLED:
+    start_snapshot_refresher()
 
 
 # Add at the top of usis.py
 BD_TIMEZONE = pytz.timezone("Asia/Dhaka")
 
+# Distinct time strings in the catalog number in the low hundreds, so a
+# bounded cache answers practically every lookup after the first refresh
+TIME_PARSE_CACHE_SIZE = 4096
+
+_TIME_PATTERN = re.compile(
+    r"^\s*(\d{1,2})(?::(\d{1,2}))?(?::(\d{1,2}))?\s*(?:([AaPp])\.?[Mm]\.?)?\s*$"
+)
+_TIME_24_PATTERN = re.compile(r"\b([01]\d|2[0-3]):[0-5]\d(?::[0-5]\d)?\b")
+
+
+@functools.lru_cache(maxsize=TIME_PARSE_CACHE_SIZE)
+def parse_time_minutes(time_str):
+    """Parse a time of day into minutes after midnight, or None if it is not one.
+
+    This is the single time parser used across the API. It accepts the
+    24-hour "HH:MM:SS", "HH:MM" and "HH" forms used by the catalog and the
+    12-hour "H:MM AM", "H:MM:SS PM" and "H AM" forms used by TIME_SLOTS and
+    the frontend. Seconds are ignored."""
+    if not isinstance(time_str, str):
+        return None
+    match = _TIME_PATTERN.match(time_str)
+    if not match:
+        return None
+    hour_text, minute_text, second_text, meridiem = match.groups()
+    hour = int(hour_text)
+    minute = int(minute_text or 0)
+    if minute > 59 or int(second_text or 0) > 59:
+        return None
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem in "Pp" else 0)
+    elif hour > 23:
+        return None
+    return hour * 60 + minute
+
+
+def format_minutes_12h(minutes):
+    """Format minutes after midnight as a 12-hour time, e.g. 570 -> "9:30 AM"."""
+    hour, minute = divmod(minutes, 60)
+    return f"{(hour % 12) or 12}:{minute:02d} {'AM' if hour < 12 else 'PM'}"
+
 
 # Create TimeUtils class
 class TimeUtils:
@@ -226,37 +1156,8 @@ class TimeUtils:
         if not tstr:
             # print(f"Warning: Empty time string")
             return 0
-
-        tstr = tstr.strip().upper()
-        # print(f"Converting time to minutes: {tstr}")
-
-        try:
-            if "AM" in tstr or "PM" in tstr:
-                if ":" not in tstr:
-                    tstr = tstr.replace(" ", ":00 ")
-                tstr = re.sub(r":\d+\s*(AM|PM)", r" \1", tstr)
-                try:
-                    dt = datetime.strptime(tstr, "%I:%M %p")
-                except ValueError:
-                    try:
-                        dt = datetime.strptime(tstr, "%I %p")
-                    except ValueError:
-                        # print(f"Warning: Could not parse time string: {tstr}")
-                        return 0
-            else:
-                try:
-                    dt = datetime.strptime(tstr, "%H:%M:%S")
-                except ValueError:
-                    try:
-                        dt = datetime.strptime(tstr, "%H:%M")
-                    except ValueError:
-                        # print(f"Warning: Could not parse time string: {tstr}")
-                        return 0
-
-            return dt.hour * 60 + dt.minute
-        except Exception as e:
-            # print(f"Error converting time to minutes: {e}")
-            return 0
+        minutes = parse_time_minutes(tstr)
+        return 0 if minutes is None else minutes
 
     @staticmethod
     def minutes_to_time(minutes):
@@ -341,15 +1242,16 @@ class ExamConflictChecker:
 
 
 # Helper function to format 24-hour time string to 12-hour AM/PM
+@functools.lru_cache(maxsize=TIME_PARSE_CACHE_SIZE)
 def convert_time_24_to_12(text):
-    def repl(match):
-        t = match.group(0)
-        t = t[:5]
-        in_time = datetime.strptime(t, "%H:%M")
-        # Use %#I for Windows, %-I for others
-        return in_time.strftime("%#I:%M %p")
+    """Rewrite every 24-hour time in the text as 12-hour time.
 
-    return re.sub(r"\b([01]\d|2[0-3]):[0-5]\d(?::[0-5]\d)?\b", repl, text)
+    "08:00:00 - 09:20:00" becomes "8:00 AM - 9:20 AM"."""
+    if not isinstance(text, str):
+        return text
+    return _TIME_24_PATTERN.sub(
+        lambda match: format_minutes_12h(parse_time_minutes(match.group(0))), text
+    )
 
 
 # Define your time slots (should match frontend)
@@ -365,20 +1267,26 @@ TIME_SLOTS = [
 
 
 def parse_time(tstr):
-    return datetime.strptime(tstr, "%I:%M %p")
+    minutes = parse_time_minutes(tstr)
+    if minutes is None:
+        raise ValueError(f"Unrecognized time: {tstr!r}")
+    return datetime(1900, 1, 1, minutes // 60, minutes % 60)
 
 
 def slot_to_minutes(slot):
     start_str, end_str = slot.split("-")
-    start = parse_time(start_str.strip())
-    end = parse_time(end_str.strip())
-    return start.hour * 60 + start.minute, end.hour * 60 + end.minute
+    start = parse_time_minutes(start_str)
+    end = parse_time_minutes(end_str)
+    if start is None or end is None:
+        raise ValueError(f"Unrecognized time slot: {slot!r}")
+    return start, end
 
 
 def schedules_overlap(start1, end1, start2, end2):
     return max(start1, start2) < min(end1, end2)
 
 
+@functools.lru_cache(maxsize=TIME_PARSE_CACHE_SIZE)
 def normalize_date(date_str):
     """Normalize date string to YYYY-MM-DD format."""
     if not date_str:
@@ -404,31 +1312,8 @@ def exam_schedules_overlap(exam1, exam2):
 
         # Convert times to minutes for comparison
         def convert_time(time_str):
-            # Handle both 24-hour and 12-hour formats
-            if isinstance(time_str, str):
-                if "AM" in time_str.upper() or "PM" in time_str.upper():
-                    # 12-hour format
-                    try:
-                        dt = datetime.strptime(time_str.strip(), "%I:%M %p")
-                        return dt.hour * 60 + dt.minute
-                    except ValueError:
-                        try:
-                            dt = datetime.strptime(time_str.strip(), "%I:%M:%S %p")
-                            return dt.hour * 60 + dt.minute
-                        except ValueError:
-                            return 0
-                else:
-                    # 24-hour format
-                    try:
-                        dt = datetime.strptime(time_str.strip(), "%H:%M:%S")
-                        return dt.hour * 60 + dt.minute
-                    except ValueError:
-                        try:
-                            dt = datetime.strptime(time_str.strip(), "%H:%M")
-                            return dt.hour * 60 + dt.minute
-                        except ValueError:
-                            return 0
-            return 0
+            minutes = parse_time_minutes(time_str)
+            return 0 if minutes is None else minutes
 
         # Get start and end times from the correct fields
         start1 = convert_time(exam1.get("start", ""))
@@ -555,16 +1440,22 @@ def has_internal_conflicts(section):
 
 @app.route("/api/course_details")
 def course_details():
-    data = load_data()
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return jsonify({"error": "Failed to load course data. Please try again later."}), 503
     code = request.args.get("course")
     # Get all sections for the course
-    all_sections = [section for section in data if section.get("courseCode") == code]
+    all_sections = snapshot.by_course.get(code, [])
 
     # Filter out sections with no available seats
     details = []
-    for section in all_sections:
-        available_seats = section.get("capacity", 0) - section.get("consumedSeat", 0)
+    for record in all_sections:
+        available_seats = record.available_seats
         if available_seats > 0:
+            # Work on a copy so the shared snapshot is not modified; nested
+            # schedules are replaced below rather than changed
+            section = dict(record.raw)
+
             # Add available seats information
             section["availableSeats"] = available_seats
 
@@ -609,14 +1500,23 @@ def course_details():
             else:
                 section["formattedFinalExamTime"] = None
 
-            # Format schedule information
+            # Format schedule information, into new dicts since the nested
+            # ones belong to the snapshot too
             if section.get("sectionSchedule"):
                 class_schedules = section["sectionSchedule"].get("classSchedules")
                 if isinstance(class_schedules, list):
-                    for schedule in class_schedules:
-                        schedule["formattedTime"] = convert_time_24_to_12(
-                            f"{schedule['startTime']} - {schedule['endTime']}"
-                        )
+                    section["sectionSchedule"] = {
+                        **section["sectionSchedule"],
+                        "classSchedules": [
+                            {
+                                **schedule,
+                                "formattedTime": convert_time_24_to_12(
+                                    f"{schedule['startTime']} - {schedule['endTime']}"
+                                ),
+                            }
+                            for schedule in class_schedules
+                        ],
+                    }
                 else:
                     # If classSchedules is not a list, skip formatting
                     pass
@@ -624,10 +1524,15 @@ def course_details():
             # Format lab schedule information
             lab_schedules = section.get("labSchedules")
             if isinstance(lab_schedules, list):
-                for schedule in lab_schedules:
-                    schedule["formattedTime"] = convert_time_24_to_12(
-                        f"{schedule['startTime']} - {schedule['endTime']}"
-                    )
+                section["labSchedules"] = [
+                    {
+                        **schedule,
+                        "formattedTime": convert_time_24_to_12(
+                            f"{schedule['startTime']} - {schedule['endTime']}"
+                        ),
+                    }
+                    for schedule in lab_schedules
+                ]
             else:
                 # If labSchedules is not a list, skip formatting
                 pass
@@ -639,25 +1544,26 @@ def course_details():
 
 @app.route("/api/faculty")
 def get_faculty():
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return jsonify({"error": "Failed to load course data. Please try again later."}), 503
     # Get unique faculty names from all sections
-    faculty = set()
-    for section in data:
-        if section.get("faculties"):
-            faculty.add(section.get("faculties"))
-    return jsonify(list(faculty))
+    return jsonify(list(snapshot.by_faculty))
 
 
 @app.route("/api/faculty_for_courses")
 def get_faculty_for_courses():
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return jsonify({"error": "Failed to load course data. Please try again later."}), 503
     course_codes = request.args.get("courses", "").split(",")
     faculty = set()
 
     # Get faculty for each course
     for code in course_codes:
-        sections = [section for section in data if section.get("courseCode") == code]
-        for section in sections:
-            if section.get("faculties"):
-                faculty.add(section.get("faculties"))
+        for record in snapshot.by_course.get(code, []):
+            if record.faculty:
+                faculty.add(record.faculty)
 
     return jsonify(list(faculty))
 
@@ -896,45 +1802,11 @@ def normalize_time(time_str):
     """Normalize time string to HH:MM:SS format."""
     if not time_str:
         return "00:00:00"
-
-    time_str = time_str.strip().upper()
-    # print(f"Normalizing time: {time_str}")
-
-    try:
-        # Handle AM/PM format
-        if "AM" in time_str or "PM" in time_str:
-            # Remove any seconds if present
-            time_str = re.sub(r":\d+\s*(AM|PM)", r" \1", time_str)
-            # Add missing colons if needed (e.g., "8 AM" -> "8:00 AM")
-            if ":" not in time_str:
-                time_str = time_str.replace(" ", ":00 ")
-            try:
-                dt = datetime.strptime(time_str, "%I:%M %p")
-            except ValueError:
-                try:
-                    dt = datetime.strptime(time_str, "%I:%M:%S %p")
-                except ValueError:
-                    # Try one more time with flexible parsing
-                    time_str = re.sub(
-                        r"(\d{1,2})(?:\s*:\s*(\d{2}))?\s*(AM|PM)", r"\1:\2 \3", time_str
-                    )
-                    # Fix the string joining operation
-                    parts = time_str.replace(":", ":00:").split(":")
-                    time_str = ":".join(parts[0:2]) + " " + time_str.split()[-1]
-                    dt = datetime.strptime(time_str, "%I:%M %p")
-            return dt.strftime("%H:%M:%S")
-        else:
-            # Handle 24-hour format
-            parts = time_str.split(":")
-            if len(parts) == 1:  # Just hours
-                return f"{int(parts[0]):02d}:00:00"
-            elif len(parts) == 2:  # Hours and minutes
-                return f"{int(parts[0]):02d}:{int(parts[1]):02d}:00"
-            else:  # Full time
-                return f"{int(parts[0]):02d}:{int(parts[1]):02d}:{int(parts[2]):02d}"
-    except Exception as e:
-        # print(f"Error normalizing time {time_str}: {e}")
+    minutes = parse_time_minutes(time_str)
+    if minutes is None:
+        # print(f"Error normalizing time {time_str}")
         return "00:00:00"  # Return midnight if parsing fails
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
 
 
 def filter_section_by_time(section, selected_times):
@@ -1107,6 +1979,829 @@ def is_valid_combination(sections):
     return True
 
 
+# Integer conflict checks between pairs of SectionRecords, which RoutineSearch
+# builds its compatibility bitsets from, and the time slot filter used by
+# filter_domains(). They mirror check_exam_conflicts(), the pairwise checks of
+# is_valid_combination() and filter_section_by_time() but only compare the
+# minutes and day numbers parsed at ingest.
+
+def meetings_conflict(meetings1, meetings2, same=False):
+    """Check whether any two (day, start, end) meetings overlap.
+
+    With same=True both arguments are the same tuple and each pair is only
+    compared once (a meeting never conflicts with itself)."""
+    for i, (day1, start1, end1) in enumerate(meetings1):
+        for day2, start2, end2 in meetings2[i + 1:] if same else meetings2:
+            if day1 == day2 and max(start1, start2) < min(end1, end2):
+                return True
+    return False
+
+
+def meeting_bits(meeting):
+    """Weekly mask of one (day, start, end) meeting, or None if it has no exact mask."""
+    day, start, end = meeting
+    if end <= start:
+        return 0  # Empty, so it cannot overlap anything
+    day_index = WEEKDAY_INDEX.get(day)
+    if day_index is None or start % MASK_GRANULARITY_MINUTES or end % MASK_GRANULARITY_MINUTES:
+        return None
+    cells = (end - start) // MASK_GRANULARITY_MINUTES
+    offset = day_index * MASK_CELLS_PER_DAY + start // MASK_GRANULARITY_MINUTES
+    return ((1 << cells) - 1) << offset
+
+
+def section_time_mask(section):
+    """Weekly mask of a section dict's class and lab meetings, or None if it has no exact mask."""
+    mask = 0
+    for sched in get_all_schedules(section):
+        if not isinstance(sched, dict) or not sched.get("day"):
+            continue
+        bits = meeting_bits((
+            str(sched["day"]).upper(),
+            TimeUtils.time_to_minutes(sched.get("startTime") or ""),
+            TimeUtils.time_to_minutes(sched.get("endTime") or ""),
+        ))
+        if bits is None:
+            return None
+        mask |= bits
+    return mask
+
+
+def exams_conflict(exam1, exam2, record1, record2, kind):
+    """Check two (day_number, start, end) exams, mirroring exam_schedules_overlap()."""
+    if exam1 is None or exam2 is None:
+        return False
+    if exam1[0] is None or exam2[0] is None:
+        # Unparseable date: defer to the dict-based check
+        return any(c["type1"] == kind for c in check_exam_conflicts(record1.raw, record2.raw))
+    if exam1[0] != exam2[0]:
+        return False
+    _, start1, end1 = exam1
+    _, start2, end2 = exam2
+    # Missing or unreadable times count as a conflict, to be safe
+    if start1 == 0 or end1 == 0 or start2 == 0 or end2 == 0:
+        return True
+    return start1 < end2 and end1 > start2
+
+
+def records_exam_conflict(record1, record2):
+    """Check whether two sections have overlapping mid-term or final exams."""
+    if record1.section_id == record2.section_id:
+        return False
+    return exams_conflict(
+        record1.mid_exam, record2.mid_exam, record1, record2, "Mid"
+    ) or exams_conflict(record1.final_exam, record2.final_exam, record1, record2, "Final")
+
+
+def records_time_conflict(record1, record2):
+    """Check whether two sections have overlapping class or lab meetings."""
+    # Sections of the same course and faculty are not compared, as in
+    # is_valid_combination()
+    if record1.course_code == record2.course_code and record1.faculty == record2.faculty:
+        return False
+    if record1.time_mask is not None and record2.time_mask is not None:
+        return bool(record1.time_mask & record2.time_mask)
+    return meetings_conflict(record1.meetings, record2.meetings)
+
+
+def time_slot_ranges(selected_times):
+    """Convert selected time slot labels to (start_min, end_min) ranges.
+
+    Returns None if a label cannot be read, in which case sections are not
+    filtered by time (filter_section_by_time() accepts them on errors)."""
+    try:
+        ranges = []
+        for time_slot in selected_times:
+            slot_start, slot_end = time_slot.split("-")
+            ranges.append((
+                TimeUtils.time_to_minutes(normalize_time(slot_start.strip())),
+                TimeUtils.time_to_minutes(normalize_time(slot_end.strip())),
+            ))
+        return ranges
+    except Exception:
+        return None
+
+
+# Every slot as minutes, used to find the slots a lab spans
+TIME_SLOT_RANGES = dict(zip(TIME_SLOTS, time_slot_ranges(TIME_SLOTS)))
+
+
+def record_time_violation(record, selected_times, selected_ranges):
+    """Check a section against the selected time slots, like filter_section_by_time().
+
+    Returns None if it fits, otherwise "labDuration" or "timeSlots"."""
+    if not selected_times or selected_ranges is None:
+        return None
+    for _, start, end in record.class_meetings:
+        if not start or not end:
+            continue  # Accept if missing time data
+        if not any(start <= range_end and end >= range_start
+                   for range_start, range_end in selected_ranges):
+            return "timeSlots"
+    for _, start, end in record.lab_meetings:
+        if not start or not end:
+            continue
+        # Labs must last at least 2 hours 50 minutes and every slot they
+        # span has to be selected
+        if end - start < 170:
+            return "labDuration"
+        for slot, (range_start, range_end) in TIME_SLOT_RANGES.items():
+            if start <= range_end and end >= range_start and slot not in selected_times:
+                return "timeSlots"
+    return None
+
+
+# Unary filters in the order filter_domains() applies them; a section is
+# counted under the first one it fails
+SECTION_FILTERS = ("seats", "internalConflict", "days", "labDuration", "timeSlots")
+
+
+def filter_domains(domains, selected_days, selected_times):
+    """Drop the sections that fail a single-section constraint, once per request.
+
+    Returns the filtered domains and, for each one, how many sections each
+    filter in SECTION_FILTERS eliminated."""
+    selected_days = {d.upper() for d in selected_days}
+    selected_ranges = time_slot_ranges(selected_times)
+    filtered = []
+    stats = []
+    for sections in domains:
+        kept = []
+        eliminated = dict.fromkeys(SECTION_FILTERS, 0)
+        for record in sections:
+            if record.available_seats <= 0:
+                reason = "seats"
+            elif record.internal_conflict:
+                reason = "internalConflict"
+            elif not all(day in selected_days for day, _, _ in record.meetings):
+                reason = "days"
+            else:
+                reason = record_time_violation(record, selected_times, selected_ranges)
+            if reason is None:
+                kept.append(record)
+            else:
+                eliminated[reason] += 1
+        filtered.append(kept)
+        stats.append({
+            "course": sections[0].course_code if sections else None,
+            "sections": len(sections),
+            "eliminated": eliminated,
+            "remaining": len(kept),
+        })
+    return filtered, stats
+
+
+def iter_bits(bits):
+    """Yield the positions of the set bits, lowest first."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+# Branch on the course with the fewest compatible sections left instead of
+# in request order. Set ROUTINE_SEARCH_MRV=0 to search in request order.
+ROUTINE_SEARCH_MRV = os.environ.get("ROUTINE_SEARCH_MRV", "1") != "0"
+# Most ranked routines a single request may ask for with topK
+ROUTINE_MAX_TOP_K = 20
+# Wall-clock budget of a routine request's search, kept below the serverless
+# function timeout. A request may ask for less with "timeBudget" (seconds).
+ROUTINE_TIME_BUDGET_SECONDS = float(os.environ.get("ROUTINE_TIME_BUDGET_SECONDS", "8"))
+# Requests with at most this many combinations of sections (after
+# filtering) check every combination in turn
+ROUTINE_EXHAUSTIVE_MAX_COMBINATIONS = 64
+# Requests with more combinations than this are turned away; 0 for no limit
+ROUTINE_MAX_COMBINATIONS = int(os.environ.get("ROUTINE_MAX_COMBINATIONS", str(10 ** 15)))
+# Random combinations checked to estimate the share of valid ones
+ROUTINE_ESTIMATE_SAMPLES = 64
+# Least routine_distance() a diverse routine keeps from every routine
+# picked before it; 0.1 rules out changing only one faculty out of five
+ROUTINE_DIVERSE_MIN_DISTANCE = 0.1
+
+
+def routine_deadline(request_data):
+    """Return the time.monotonic() deadline for a routine request and None, or None and an error."""
+    budget = request_data.get("timeBudget", ROUTINE_TIME_BUDGET_SECONDS)
+    if (
+        isinstance(budget, bool)
+        or not isinstance(budget, (int, float))
+        or not math.isfinite(budget)
+        or budget <= 0
+    ):
+        return None, "timeBudget must be a positive number of seconds"
+    return time.monotonic() + min(budget, ROUTINE_TIME_BUDGET_SECONDS), None
+
+
+def routine_options(request_data):
+    """Return ((top_k, diverse), None) for a routine request, or (None, None) and an error.
+
+    topK asks for the best routines by calculate_routine_score(), capped at
+    ROUTINE_MAX_TOP_K; diverse asks for topK routines that differ from each
+    other instead of the best ones, which are often near copies."""
+    top_k = request_data.get("topK")
+    if top_k is not None:
+        if isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 1:
+            return (None, None), "topK must be a positive integer"
+        top_k = min(top_k, ROUTINE_MAX_TOP_K)
+    diverse = request_data.get("diverse", False)
+    if not isinstance(diverse, bool):
+        return (None, None), "diverse must be true or false"
+    if diverse and not top_k:
+        return (None, None), "diverse needs topK"
+    return (top_k, diverse), None
+
+
+def section_classes(domains):
+    """Group each domain's sections into classes that fit exactly the same routines.
+
+    Conflict checks and routine scores only look at a section's meetings
+    and exams, so sections that share them are interchangeable. Returns,
+    per domain, the section indexes of each class, with the classes in
+    order of their first section. When a course is requested twice the
+    faculty has to match as well, since sections of one course and faculty
+    are never checked for time conflicts. A section listed in more than
+    one domain, or with an exam date that could not be read, gets a class
+    of its own."""
+    course_domains = {}
+    section_domains = {}
+    for d, sections in enumerate(domains):
+        for record in sections:
+            course_domains.setdefault(record.course_code, set()).add(d)
+            section_domains.setdefault(record.section_id, set()).add(d)
+    classes = []
+    for sections in domains:
+        by_signature = {}
+        for index, record in enumerate(sections):
+            if len(section_domains[record.section_id]) > 1 or any(
+                exam is not None and exam[0] is None
+                for exam in (record.mid_exam, record.final_exam)
+            ):
+                signature = index
+            else:
+                signature = (
+                    record.class_meetings, record.lab_meetings, record.mid_exam, record.final_exam
+                )
+                if len(course_domains[record.course_code]) > 1:
+                    signature += (record.faculty,)
+            by_signature.setdefault(signature, []).append(index)
+        classes.append(list(by_signature.values()))
+    return classes
+
+
+class RoutineSearch:
+    """Depth-first search for routines over one request's candidate sections.
+
+    ``domains`` holds the SectionRecords for each course. Courses are
+    assigned one at a time and a partial routine is abandoned as soon as a
+    section breaks a constraint, so the full cartesian product is never
+    built.
+
+    Compatibility between sections of two courses is worked out once per
+    pair and kept as bitsets over the other course's sections, so the
+    search itself only ANDs integers. Exam conflicts are always checked and
+    class/lab time conflicts when check_times is set. Single-section
+    constraints are expected to be applied beforehand by filter_domains().
+
+    With group_equivalent, the search branches on classes of sections from
+    section_classes() rather than on single sections, and each routine it
+    finds over the classes stands for every combination of their members.
+    Results are still given as sections.
+
+    With the snapshot the domains were taken from, pair checks go through
+    the CompatibilityCache shared with other requests.
+
+    With a deadline, the search stops once it passes and sets timed_out;
+    whatever was yielded or collected before that is still valid.
+
+    With most_constrained_first, every assignment narrows the sections
+    left for the unassigned courses and the search branches next on the
+    course with the fewest, so dead ends show up near the root. The count
+    is divided by how often that course has already run out of sections,
+    which steers the search towards the courses that cause failures
+    (the dom/wdeg heuristic). Otherwise
+    courses are assigned in request order and routines come out in the
+    same order as itertools.product() (over the classes, when grouped)."""
+
+    def __init__(self, domains, check_times=True, most_constrained_first=None, deadline=None,
+                 group_equivalent=True, snapshot=None):
+        self.domains = domains
+        self.check_times = check_times
+        self.group_equivalent = group_equivalent
+        self.snapshot = snapshot
+        # Per domain, each class's (course code, position in
+        # snapshot.by_course) or None, filled in as needed
+        self.positions = {}
+        # Per domain, the section indexes in each class
+        if group_equivalent:
+            self.classes = section_classes(domains)
+        else:
+            self.classes = [[[index] for index in range(len(sections))] for sections in domains]
+        # Per domain, the first section of each class, which the search uses
+        # for the whole class
+        self.class_records = [
+            [sections[members[0]] for members in classes]
+            for sections, classes in zip(domains, self.classes)
+        ]
+        # time.monotonic() value after which the search stops early
+        self.deadline = deadline
+        self.timed_out = False
+        # In request order, the (after, inclusive) arguments of paths()
+        # that resume a timed out search
+        self.resume_from = None
+        self.most_constrained_first = (
+            ROUTINE_SEARCH_MRV if most_constrained_first is None else most_constrained_first
+        )
+        # Bitset of the classes in each domain the search may use
+        self.candidates = [
+            sum(
+                1 << index
+                for index, record in enumerate(records)
+                if not (check_times and record.internal_conflict)
+            )
+            for records in self.class_records
+        ]
+        # (depth, index, other_depth) -> (bitset of compatible classes in
+        # other_depth, number of pairs it covers)
+        self.compatible = {}
+        self.pair_checks = 0
+        self.pair_checks_reused = 0
+        self.nodes = 0
+        self.pruned = 0
+        self._count_memo = {}
+
+    def conflict(self, record1, record2):
+        return records_exam_conflict(record1, record2) or (
+            self.check_times and records_time_conflict(record1, record2)
+        )
+
+    def compatible_with(self, depth, index, other_depth):
+        """Bitset of the candidates in ``other_depth`` that fit class ``index`` of ``depth``."""
+        key = (depth, index, other_depth)
+        entry = self.compatible.get(key)
+        if entry is not None:
+            self.pair_checks_reused += entry[1]
+            return entry[0]
+        record = self.class_records[depth][index]
+        others = self.class_records[other_depth]
+        positions = None
+        if self.snapshot is not None and record.section_id is not None:
+            positions = self.snapshot_positions(other_depth)
+        # Conflicts with each course, from the shared cache
+        rows = {}
+        bits = 0
+        checked = 0
+        for other in iter_bits(self.candidates[other_depth]):
+            checked += 1
+            place = positions[other] if positions is not None else None
+            if place is None:
+                conflict = self.conflict(record, others[other])
+            else:
+                course_code, position = place
+                row = rows.get(course_code)
+                if row is None:
+                    exam_bits, time_bits = _compatibility_cache.conflicts(
+                        self.snapshot, record, course_code
+                    )
+                    row = rows[course_code] = exam_bits | time_bits if self.check_times else exam_bits
+                conflict = row >> position & 1
+            if not conflict:
+                bits |= 1 << other
+        self.pair_checks += checked
+        self.compatible[key] = (bits, checked)
+        return bits
+
+    def snapshot_positions(self, depth):
+        """Per class of ``depth``, its first section's course code and
+        position in snapshot.by_course, or None if it is not listed there."""
+        positions = self.positions.get(depth)
+        if positions is None:
+            positions = []
+            course_positions = {}
+            for record in self.class_records[depth]:
+                course_code = record.course_code
+                if course_code not in course_positions:
+                    course_positions[course_code] = {
+                        id(other): position
+                        for position, other in enumerate(self.snapshot.by_course.get(course_code, ()))
+                    }
+                position = course_positions[course_code].get(id(record))
+                positions.append(None if position is None else (course_code, position))
+            self.positions[depth] = positions
+        return positions
+
+    def paths(self, prune=None, after=None, inclusive=False):
+        """Yield every valid combination as a tuple of section indexes, one per domain.
+
+        ``prune(chosen, unassigned)`` is called after each assignment, where
+        ``chosen[d]`` is the first section of the class picked for every
+        domain d not in ``unassigned``; returning True skips everything
+        below that node.
+
+        In request order and without group_equivalent, ``after`` resumes
+        the search right after that path (or at it, with inclusive),
+        without visiting anything that comes before it."""
+        if after is not None and self.group_equivalent:
+            raise ValueError("Only a search without grouped sections can resume")
+        for class_path in self.class_paths(prune, after, inclusive):
+            yield from self.expand(class_path)
+
+    def class_paths(self, prune=None, after=None, inclusive=False):
+        """paths(), yielding each valid combination of classes once, as class indexes."""
+        if not self.domains:
+            return
+        if prune is not None:
+            first = [[members[0] for members in classes] for classes in self.classes]
+            prune_sections = prune
+
+            def prune(chosen, unassigned):
+                return prune_sections(
+                    [None if index is None else first[d][index] for d, index in enumerate(chosen)],
+                    unassigned,
+                )
+
+        if self.most_constrained_first:
+            if after is not None:
+                raise ValueError("Only a search in request order can resume")
+            yield from self._paths_most_constrained_first(prune)
+        else:
+            yield from self._paths_in_order(prune, after, inclusive)
+
+    def expand(self, class_path):
+        """Yield the section paths a combination of classes stands for, in order."""
+        return product(*[self.classes[d][index] for d, index in enumerate(class_path)])
+
+    def out_of_time(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.timed_out = True
+        return self.timed_out
+
+    def _paths_in_order(self, prune, after, inclusive):
+        domains = self.domains
+        chosen = []
+
+        def extend(depth, on_after):
+            # on_after: the routine so far is the same as the start of after
+            if depth == len(domains):
+                if inclusive or not on_after:
+                    yield tuple(chosen)
+                return
+            allowed = self.candidates[depth]
+            if on_after:
+                # Skip the sections that come before after[depth]
+                allowed &= ~((1 << after[depth]) - 1)
+            for d, index in enumerate(chosen):
+                if not allowed:
+                    return
+                allowed &= self.compatible_with(d, index, depth)
+            for index in iter_bits(allowed):
+                if self.out_of_time():
+                    # Nothing at or below this node has been searched yet
+                    if on_after and index == after[depth]:
+                        self.resume_from = (after, inclusive)
+                    else:
+                        rest = (0,) * (len(domains) - depth - 1)
+                        self.resume_from = (tuple(chosen) + (index,) + rest, True)
+                    return
+                self.nodes += 1
+                chosen.append(index)
+                if prune is None or not prune(chosen, range(depth + 1, len(domains))):
+                    yield from extend(depth + 1, on_after and index == after[depth])
+                chosen.pop()
+                if self.timed_out:
+                    return
+
+        if after is None:
+            yield from extend(0, False)
+        elif len(after) == len(domains):
+            yield from extend(0, True)
+
+    def _paths_most_constrained_first(self, prune):
+        chosen = [None] * len(self.domains)
+        # 1 + the number of times each domain was emptied by an assignment
+        failures = [1] * len(self.domains)
+
+        def extend(allowed):
+            # allowed maps each unassigned domain to the bitset of its
+            # sections that fit everything assigned so far
+            if not allowed:
+                yield tuple(chosen)
+                return
+            depth = min(allowed, key=lambda d: (bin(allowed[d]).count("1") / failures[d], d))
+            rest = [(d, bits) for d, bits in allowed.items() if d != depth]
+            for index in iter_bits(allowed[depth]):
+                if self.out_of_time():
+                    return
+                self.nodes += 1
+                narrowed = {}
+                for other, bits in rest:
+                    bits &= self.compatible_with(depth, index, other)
+                    if not bits:
+                        failures[other] += 1
+                        break
+                    narrowed[other] = bits
+                else:
+                    chosen[depth] = index
+                    if prune is None or not prune(chosen, narrowed):
+                        yield from extend(narrowed)
+                    if self.timed_out:
+                        return
+
+        if all(self.candidates):
+            yield from extend(dict(enumerate(self.candidates)))
+
+    def routines(self):
+        """Yield every valid combination as a tuple of SectionRecords."""
+        for path in self.paths():
+            yield tuple(sections[index] for sections, index in zip(self.domains, path))
+
+    def first(self):
+        """Return the first valid combination, or None."""
+        return next(self.routines(), None)
+
+    def best(self, k, scorer):
+        """Return the k highest-scoring routines as (score, combination) pairs.
+
+        Branches whose upper bound from scorer.bound() is below the current
+        k-th best score are cut. Equal scores are ranked by request order."""
+        return [
+            (score, tuple(sections[index] for sections, index in zip(self.domains, path)))
+            for score, path in self.best_paths(k, scorer)
+        ]
+
+    def best_paths(self, k, scorer, floor=None):
+        """best(), with the routines as paths.
+
+        ``floor`` is a shared multiprocessing.Value holding a score that k
+        routines elsewhere in the tree are known to reach; branches are also
+        cut against it, and it is raised whenever this search beats it.
+
+        The search keeps the best k combinations of classes. That is
+        enough, since a combination of classes is ranked ahead of all the
+        routines it stands for except its first."""
+        # Min-heap of (score, negated class path) holding the best k so far
+        kept = []
+        first = [[members[0] for members in classes] for classes in self.classes]
+
+        def prune(chosen, unassigned):
+            cutoff = kept[0][0] if len(kept) == k else None
+            if floor is not None and (cutoff is None or floor.value > cutoff):
+                cutoff = floor.value
+            if cutoff is not None and scorer.bound(chosen, unassigned) < cutoff:
+                self.pruned += 1
+                return True
+            return False
+
+        for class_path in self.class_paths(prune):
+            path = tuple(first[d][index] for d, index in enumerate(class_path))
+            entry = (scorer.score(path), tuple(-index for index in class_path))
+            if len(kept) < k:
+                heapq.heappush(kept, entry)
+            elif entry > kept[0]:
+                heapq.heapreplace(kept, entry)
+            else:
+                continue
+            if floor is not None and len(kept) == k and kept[0][0] > floor.value:
+                with floor.get_lock():
+                    floor.value = max(floor.value, kept[0][0])
+        ranked = []
+        for score, class_path in kept:
+            for path in islice(self.expand(tuple(-index for index in class_path)), k):
+                ranked.append((score, tuple(-index for index in path)))
+        ranked.sort(reverse=True)
+        return [(score, tuple(-index for index in path)) for score, path in ranked[:k]]
+
+    def diverse(self, k, scorer):
+        """Return up to k routines that differ from each other as much as possible,
+        as (score, combination) pairs."""
+        return [
+            (score, tuple(sections[index] for sections, index in zip(self.domains, path)))
+            for score, path in self.diverse_paths(k, scorer)
+        ]
+
+    def diverse_paths(self, k, scorer):
+        """diverse(), with the routines as paths.
+
+        The first routine is the best by ``scorer``. Each next one is the
+        routine furthest by routine_distance() from the closest routine
+        picked so far, and the best scoring among equally far ones. Branches
+        that cannot get ROUTINE_DIVERSE_MIN_DISTANCE away from every picked
+        routine are cut, so near copies of them are never scored."""
+        picked = self.best_paths(1, scorer)
+        search = self
+        if self.group_equivalent:
+            # The sections of a class can differ in faculty, so the rest are
+            # picked from single sections
+            search = RoutineSearch(
+                self.domains, self.check_times, self.most_constrained_first, self.deadline,
+                group_equivalent=False, snapshot=self.snapshot,
+            )
+        while picked and len(picked) < k and not self.timed_out and not search.timed_out:
+            spread = DiverseRoutineScorer(scorer, self.domains, [path for _, path in picked])
+            # (distance, score) and negated path of the best routine so far
+            best = None
+
+            def prune(chosen, unassigned):
+                bound = spread.bound(chosen, unassigned)
+                if bound[0] < ROUTINE_DIVERSE_MIN_DISTANCE or (best is not None and bound < best[0]):
+                    search.pruned += 1
+                    return True
+                return False
+
+            for path in search.paths(prune):
+                entry = (spread.score(path), tuple(-index for index in path))
+                if entry[0][0] >= ROUTINE_DIVERSE_MIN_DISTANCE and (best is None or entry > best):
+                    best = entry
+            if best is None:
+                break
+            picked.append((best[0][1], tuple(-index for index in best[1])))
+        if search is not self:
+            self.pair_checks += search.pair_checks
+            self.pair_checks_reused += search.pair_checks_reused
+            self.nodes += search.nodes
+            self.pruned += search.pruned
+            self.timed_out = self.timed_out or search.timed_out
+        return picked
+
+    def _counting_order(self):
+        # Courses with the fewest candidates first, and the number of
+        # sections behind each class
+        order = sorted(
+            range(len(self.domains)), key=lambda d: (bin(self.candidates[d]).count("1"), d)
+        )
+        sizes = [[len(members) for members in classes] for classes in self.classes]
+        return order, sizes
+
+    def _narrow(self, order, level, index, allowed):
+        """Sections left for the courses after ``level`` once class ``index``
+        is picked there, or None if one of them has none left."""
+        depth = order[level]
+        narrowed = []
+        for position, bits in enumerate(allowed[1:], level + 1):
+            bits &= self.compatible_with(depth, index, order[position])
+            if not bits:
+                return None
+            narrowed.append(bits)
+        return tuple(narrowed)
+
+    def count(self):
+        """Return the number of valid combinations, or None if the deadline passes first.
+
+        Two partial routines that leave the same sections open for every
+        remaining course have the same number of completions, so each such
+        state is only counted once."""
+        if not self.domains:
+            return 0
+        order, sizes = self._counting_order()
+        # (level, sections left for each course from level on) -> completions,
+        # kept so an estimate after a timeout can reuse the finished parts
+        memo = self._count_memo = {}
+
+        def completions(level, allowed):
+            if level == len(order):
+                return 1
+            key = (level, allowed)
+            total = memo.get(key)
+            if total is not None:
+                return total
+            total = 0
+            for index in iter_bits(allowed[0]):
+                if self.out_of_time():
+                    return None
+                self.nodes += 1
+                narrowed = self._narrow(order, level, index, allowed)
+                if narrowed is None:
+                    continue
+                below = completions(level + 1, narrowed)
+                if below is None:
+                    return None
+                total += sizes[order[level]][index] * below
+            memo[key] = total
+            return total
+
+        return completions(0, tuple(self.candidates[d] for d in order))
+
+    def estimate_count(self, deadline, rng, max_samples=20000):
+        """Estimate the number of valid combinations by random probing (Knuth's estimator).
+
+        Each probe walks from the root to a leaf or dead end, picking a
+        section at every level with probability proportional to how many
+        combinations it leaves open for the remaining courses, and dividing
+        by that probability; the average of the probes is an unbiased
+        estimate. Weighting the choices keeps the probes close to the true
+        count, which plain uniform choices do not.
+        Parts already counted exactly by an interrupted count() are used as is.
+        Probes run until ``deadline`` (at least two) or max_samples.
+        Returns (estimate, half-width of the 95% confidence interval, probes)."""
+        if not self.domains:
+            return 0.0, 0.0, 0
+        order, sizes = self._counting_order()
+        memo = self._count_memo
+        values = []
+        while len(values) < 2 or (len(values) < max_samples and time.monotonic() < deadline):
+            allowed = tuple(self.candidates[d] for d in order)
+            value = 1
+            for level in range(len(order)):
+                known = memo.get((level, allowed))
+                if known is not None:
+                    value *= known
+                    break
+                choices = []
+                weights = []
+                for index in iter_bits(allowed[0]):
+                    narrowed = self._narrow(order, level, index, allowed)
+                    if narrowed is None:
+                        continue
+                    weight = sizes[order[level]][index]
+                    for position, bits in enumerate(narrowed, level + 1):
+                        domain_sizes = sizes[order[position]]
+                        weight *= sum(domain_sizes[other] for other in iter_bits(bits))
+                    choices.append((index, narrowed))
+                    weights.append(weight)
+                if not choices:
+                    value = 0
+                    break
+                pick = rng.choices(range(len(choices)), weights)[0]
+                index, allowed = choices[pick]
+                value *= sizes[order[level]][index] * sum(weights) / weights[pick]
+            values.append(value)
+        mean = sum(values) / len(values)
+        variance = sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+        return mean, 1.96 * (variance / len(values)) ** 0.5, len(values)
+
+    def valid_share(self, rng, samples):
+        """Share of ``samples`` combinations, drawn uniformly from the
+        candidate sections, that are valid routines."""
+        if not self.domains or not all(self.candidates) or not samples:
+            return 0.0
+        drawn = []
+        for d, bits in enumerate(self.candidates):
+            indexes = list(iter_bits(bits))
+            weights = [len(self.classes[d][index]) for index in indexes]
+            drawn.append(rng.choices(indexes, weights, k=samples))
+        records = self.class_records
+        pairs = [(d, o) for d in range(len(drawn)) for o in range(d + 1, len(drawn))]
+        # With every course listed once and every meeting readable, sections
+        # clash in time exactly when their weekly masks overlap, so the
+        # times of a combination are checked in one pass
+        fold_times = (
+            self.check_times
+            and len({sections[0].course_code for sections in self.domains}) == len(self.domains)
+            and all(record.time_mask is not None for classes in records for record in classes)
+        )
+        valid = 0
+        for path in zip(*drawn):
+            chosen = [records[d][index] for d, index in enumerate(path)]
+            if fold_times:
+                occupied = 0
+                for record in chosen:
+                    if occupied & record.time_mask:
+                        break
+                    occupied |= record.time_mask
+                else:
+                    valid += not any(records_exam_conflict(chosen[d], chosen[o]) for d, o in pairs)
+            else:
+                valid += not any(self.conflict(chosen[d], chosen[o]) for d, o in pairs)
+        return valid / samples
+
+    def stats(self):
+        return {
+            "pairChecksComputed": self.pair_checks,
+            "pairChecksReused": self.pair_checks_reused,
+            "nodesExplored": self.nodes,
+            "branchesPruned": self.pruned,
+            "timedOut": self.timed_out,
+        }
+
+
+class ExhaustiveRoutineSearch(RoutineSearch):
+    """RoutineSearch that checks every combination in turn, for requests
+    so small that narrowing and reordering the courses costs more than it
+    saves. Routines come out in the same order as itertools.product()."""
+
+    def __init__(self, domains, deadline=None):
+        super().__init__(domains, most_constrained_first=False, deadline=deadline,
+                         group_equivalent=False)
+
+    def class_paths(self, prune=None, after=None, inclusive=False):
+        """paths(), ignoring ``prune``; cannot resume from ``after``."""
+        if after is not None:
+            raise ValueError("An exhaustive search cannot resume")
+        if not self.domains:
+            return
+        records = self.class_records
+        pairs = [(d, o) for d in range(len(records)) for o in range(d + 1, len(records))]
+        for path in product(*(list(iter_bits(bits)) for bits in self.candidates)):
+            if self.out_of_time():
+                return
+            self.nodes += 1
+            for d, o in pairs:
+                self.pair_checks += 1
+                if self.conflict(records[d][path[d]], records[o][path[o]]):
+                    break
+            else:
+                yield path
+
+
 def try_all_section_combinations(course_sections_map, selected_days, selected_times):
     """Try all possible combinations of sections to find a valid routine."""
     try:
@@ -1210,13 +2905,392 @@ def try_all_section_combinations(course_sections_map, selected_days, selected_ti
         return None, f"Error finding valid combinations: {e}"
 
 
+def gather_course_sections(snapshot, courses):
+    """Collect the sections of each requested course from the snapshot.
+
+    ``courses`` is the "courses" list of a routine request. Returns a list
+    of SectionRecord lists, one per course, and None, or None and an error
+    message for a 400 response."""
+    all_combinations = []
+    for course in courses:
+        course_code = course["course"]
+        faculty_list = course["faculty"]
+        sections_by_faculty = course.get("sections", {})
+
+        # Find all sections for this course
+        course_sections = []
+
+        # Get all sections for the course
+        available_sections = snapshot.by_course.get(course_code, [])
+
+        if not available_sections:
+            # print(f"Course not found in fresh data: {course_code}")
+            return None, f"Course {course_code} not found in available courses"
+
+        # If no faculty selected, get all sections (full ones are
+        # dropped by filter_domains())
+        if not faculty_list:
+            # print(f"No faculty selected for {course_code}, getting all available sections")
+            course_sections = list(available_sections)
+        else:
+            # Get sections for selected faculty
+            for faculty in faculty_list:
+                if faculty in sections_by_faculty:
+                    # If a specific section is selected for this faculty
+                    section_name = sections_by_faculty[faculty]
+                    course_sections.extend(
+                        record
+                        for record in snapshot.by_course_section.get(
+                            (course_code, str(section_name)), []
+                        )
+                        if record.section_name == section_name and record.faculty == faculty
+                    )
+                else:
+                    # If no specific section is selected, get all sections for this faculty
+                    faculty_sections = [
+                        r for r in snapshot.by_faculty.get(faculty, [])
+                        if r.course_code == course_code
+                    ]
+                    course_sections.extend(faculty_sections)
+
+        if not any(record.available_seats > 0 for record in course_sections):
+            msg = "No available sections found"
+            if faculty_list:
+                msg += " with selected faculty"
+            msg += f" for {course_code}"
+            # print(msg)
+            return None, msg
+
+        # print(f"Found {len(course_sections)} sections for {course_code}")
+        all_combinations.append(course_sections)
+
+    if not all_combinations:
+        return None, "No valid sections found for any courses"
+    return all_combinations, None
+
+
+# Worker processes for heavy routine searches; 1 searches in the request thread
+ROUTINE_WORKERS = int(os.environ.get("ROUTINE_WORKERS", "1"))
+# Fewest combinations (after filtering) worth splitting across the workers
+ROUTINE_PARALLEL_MIN_COMBINATIONS = int(os.environ.get("ROUTINE_PARALLEL_MIN_COMBINATIONS", "200000"))
+# Tasks per worker, so that one slow part of the tree does not hold up the rest
+ROUTINE_TASKS_PER_WORKER = 4
+# How long past the request deadline to wait for the workers before giving
+# up on the pool and searching in the request thread
+ROUTINE_POOL_GRACE_SECONDS = 1.0
+
+# The workers are forked with _routine_pool_snapshot and the shared values
+# already in place, so tasks only carry the request fields and section ranges.
+# Forking a multi-threaded process only copies the forking thread: a lock
+# another thread (a request or the refresher) held at that moment stays held
+# in the child forever. Workers therefore must not take any lock shared with
+# the server's threads, and run() stops waiting on a pool that hangs.
+_routine_pool = None
+_routine_pool_snapshot = None
+# Lowest task that has found a routine, so later tasks can stop looking
+_routine_pool_found = None
+# Score the best k routines found by any task so far all reach
+_routine_pool_floor = None
+# Held for the whole of a pooled search, since the shared values are per search
+_routine_pool_lock = threading.Lock()
+
+
+def routine_pool(snapshot):
+    """Process pool whose workers were forked with this snapshot, or None if it is unavailable.
+
+    Must be called with _routine_pool_lock held."""
+    global _routine_pool, _routine_pool_snapshot, _routine_pool_found, _routine_pool_floor
+    if ROUTINE_WORKERS < 2:
+        return None
+    if _routine_pool is not None and _routine_pool_snapshot.version != snapshot.version:
+        # Fork new workers so they see the new snapshot
+        _routine_pool.shutdown(wait=False, cancel_futures=True)
+        _routine_pool = None
+    if _routine_pool is None:
+        try:
+            context = multiprocessing.get_context("fork")
+            _routine_pool_found = context.Value("i", 0)
+            _routine_pool_floor = context.Value("d", float("-inf"))
+            _routine_pool_snapshot = snapshot
+            _routine_pool = ProcessPoolExecutor(
+                ROUTINE_WORKERS, mp_context=context, initializer=init_routine_worker
+            )
+        except (OSError, ValueError) as e:
+            # Serverless runtimes may not provide fork or shared memory
+            # print(f"Routine process pool unavailable: {str(e)}")
+            return None
+    return _routine_pool
+
+
+def init_routine_worker():
+    """Give a newly forked worker its own compatibility cache.
+
+    The inherited one may have been locked by a request thread at fork time,
+    and that lock would never be released in the worker."""
+    global _compatibility_cache
+    _compatibility_cache = CompatibilityCache(COMPATIBILITY_CACHE_SIZE)
+
+
+def discard_routine_pool():
+    """Shut the routine pool down without waiting and stop its workers.
+
+    Must be called with _routine_pool_lock held."""
+    global _routine_pool
+    pool, _routine_pool = _routine_pool, None
+    if pool is None:
+        return
+    # shutdown() leaves running tasks alone, and a hung worker would never exit
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        try:
+            process.terminate()
+        except (OSError, ValueError):
+            pass
+
+
+class PooledRoutineSearch(RoutineSearch):
+    """RoutineSearch for one task of a pooled search, in a worker process."""
+
+    def __init__(self, domains, task, deadline=None):
+        super().__init__(domains, deadline=deadline, snapshot=_routine_pool_snapshot)
+        self.task = task
+
+    def out_of_time(self):
+        # An earlier task already has a routine, which is the one kept
+        if _routine_pool_found.value < self.task:
+            return True
+        return super().out_of_time()
+
+
+def search_routine_part(fields, top_k, split, part, task, deadline):
+    """Run one task of a pooled search: the request's search with course
+    ``split`` limited to the sections in bitset ``part``.
+
+    Returns the best (score, path) pairs with top_k, or else the first
+    path or None, followed by the search statistics."""
+    all_combinations, _ = gather_course_sections(_routine_pool_snapshot, fields["courses"])
+    candidate_sections, _ = filter_domains(all_combinations, fields["days"], fields["times"])
+    search = PooledRoutineSearch(candidate_sections, task, deadline=deadline)
+    search.candidates[split] &= part
+    if top_k:
+        scorer = RoutineScorer(candidate_sections, fields["days"], fields["commutePreference"])
+        result = search.best_paths(top_k, scorer, _routine_pool_floor)
+    else:
+        result = next(search.paths(), None)
+        if result is not None:
+            with _routine_pool_found.get_lock():
+                _routine_pool_found.value = min(_routine_pool_found.value, task)
+    return result, search.stats()
+
+
+class ParallelRoutineSearch:
+    """best() and first() of a RoutineSearch, split across the routine process pool.
+
+    The tree is split on the course the search branches on first: each
+    task covers a contiguous range of its sections, so the task with the
+    lowest range that finds a routine has the one the search would have
+    found first. Tasks stop once an earlier one has found a routine, and
+    with topK they share the lowest score worth keeping. routine_engine()
+    picks the requests that come here; while the pool is busy or
+    unavailable they use the search as is."""
+
+    def __init__(self, search, snapshot, request_data):
+        self.search = search
+        self.snapshot = snapshot
+        self.fields = {
+            "courses": request_data["courses"],
+            "days": request_data.get("days", []),
+            "times": request_data.get("times", []),
+            "commutePreference": request_data.get("commutePreference", ""),
+        }
+        self.merged_stats = None
+        self.timed_out = False
+
+    def run(self, top_k):
+        """Return the results of every task, or None to search serially.
+
+        Waits for the workers until the search deadline plus
+        ROUTINE_POOL_GRACE_SECONDS; a pool that has not finished by then is
+        discarded and the request is searched serially instead."""
+        search = self.search
+        if not _routine_pool_lock.acquire(blocking=False):
+            return None
+        try:
+            pool = routine_pool(self.snapshot)
+            if pool is None:
+                return None
+            if search.most_constrained_first:
+                split = min(
+                    range(len(search.candidates)),
+                    key=lambda d: (bin(search.candidates[d]).count("1"), d),
+                )
+            else:
+                split = 0
+            indexes = list(iter_bits(search.candidates[split]))
+            tasks = min(len(indexes), ROUTINE_WORKERS * ROUTINE_TASKS_PER_WORKER)
+            parts = []
+            for task in range(tasks):
+                chunk = indexes[task * len(indexes) // tasks:(task + 1) * len(indexes) // tasks]
+                parts.append(sum(1 << index for index in chunk))
+            _routine_pool_found.value = tasks
+            _routine_pool_floor.value = float("-inf")
+            futures = [
+                pool.submit(
+                    search_routine_part, self.fields, top_k, split, part, task, search.deadline
+                )
+                for task, part in enumerate(parts)
+            ]
+            if search.deadline is None:
+                timeout = ROUTINE_TIME_BUDGET_SECONDS + ROUTINE_POOL_GRACE_SECONDS
+            else:
+                timeout = max(search.deadline - time.monotonic(), 0) + ROUTINE_POOL_GRACE_SECONDS
+            _, not_done = wait(futures, timeout=timeout)
+            if not_done:
+                # print(f"Routine pool did not finish in {timeout:.1f}s, searching serially")
+                discard_routine_pool()
+                return None
+            results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            discard_routine_pool()
+            return None
+        finally:
+            _routine_pool_lock.release()
+        self.merged_stats = {}
+        for _, stats in results:
+            for key, value in stats.items():
+                self.merged_stats[key] = self.merged_stats.get(key, 0) + value
+        self.timed_out = any(stats["timedOut"] for _, stats in results)
+        self.merged_stats["timedOut"] = self.timed_out
+        self.merged_stats["workers"] = ROUTINE_WORKERS
+        return [result for result, _ in results]
+
+    def best(self, k, scorer):
+        results = self.run(k)
+        if results is None:
+            ranked = self.search.best(k, scorer)
+            self.timed_out = self.search.timed_out
+            return ranked
+        entries = [
+            (score, tuple(-index for index in path))
+            for ranked in results for score, path in ranked
+        ]
+        entries = sorted(entries, reverse=True)[:k]
+        return [
+            (score, tuple(sections[-index] for sections, index in zip(self.search.domains, path)))
+            for score, path in entries
+        ]
+
+    def first(self):
+        results = self.run(None)
+        if results is None:
+            combination = self.search.first()
+            self.timed_out = self.search.timed_out
+            return combination
+        for path in results:
+            if path is not None:
+                return tuple(sections[index] for sections, index in zip(self.search.domains, path))
+        return None
+
+    def stats(self):
+        return self.merged_stats if self.merged_stats is not None else self.search.stats()
+
+
+def routine_engine(combinations, valid_share, top_k, use_ai, diverse=False):
+    """Name of the search for a request, or None if it has too many
+    combinations of sections to search."""
+    if ROUTINE_MAX_COMBINATIONS and combinations > ROUTINE_MAX_COMBINATIONS:
+        return None
+    if combinations <= ROUTINE_EXHAUSTIVE_MAX_COMBINATIONS:
+        return "exhaustive"
+    # Where the samples found valid routines the first one turns up after a
+    # few dead ends, so only a ranking or a search for a rare routine is
+    # worth splitting across the workers
+    if (
+        ROUTINE_WORKERS > 1
+        and combinations >= ROUTINE_PARALLEL_MIN_COMBINATIONS
+        and not diverse
+        and (top_k or (not use_ai and not valid_share))
+    ):
+        return "parallel"
+    return "backtracking"
+
+
+def routine_size_estimate(candidate_sections, snapshot, deadline, top_k=None, use_ai=False,
+                          diverse=False):
+    """Size up a request before searching it.
+
+    Returns the search for its filtered sections and the estimate: the
+    number of combinations of the sections, the share of valid routines
+    among up to ROUTINE_ESTIMATE_SAMPLES of them drawn at random, the
+    number of routines that share comes to, and the engine from
+    routine_engine(). The "parallel" engine is a RoutineSearch to be run
+    through ParallelRoutineSearch."""
+    combinations = math.prod(len(sections) for sections in candidate_sections)
+    if combinations <= ROUTINE_EXHAUSTIVE_MAX_COMBINATIONS:
+        search = ExhaustiveRoutineSearch(candidate_sections, deadline=deadline)
+    else:
+        search = RoutineSearch(candidate_sections, deadline=deadline, snapshot=snapshot)
+    samples = min(combinations, ROUTINE_ESTIMATE_SAMPLES)
+    # A fixed seed gives the same estimate for the same request
+    share = search.valid_share(random.Random(0), samples)
+    engine = routine_engine(combinations, share, top_k, use_ai, diverse)
+    return search, {
+        "combinations": combinations,
+        "samples": samples,
+        "validShare": share,
+        "estimatedRoutines": round(combinations * share),
+        "engine": engine,
+    }
+
+
+def routine_size_error(size_estimate):
+    return (
+        f"This request has {size_estimate['combinations']:,} combinations of sections, "
+        f"more than the {ROUTINE_MAX_COMBINATIONS:,} one request may search. "
+        "Try fewer courses or narrower preferences."
+    )
+
+
+def routine_cache_key(snapshot, request_data, top_k):
+    """Return the RoutineCache key of a /api/routine request, and the place
+    of each of its courses in canonical order.
+
+    Courses, faculty lists, days and time slots are sorted, so requests
+    that only list them in a different order share results. The key holds
+    the snapshot's schedule fingerprint rather than its version, so results
+    outlive refreshes that only change seat counts."""
+    courses = [
+        json.dumps({
+            "course": course.get("course"),
+            "faculty": sorted(course.get("faculty") or [], key=str),
+            "sections": course.get("sections") or {},
+        }, sort_keys=True)
+        for course in request_data["courses"]
+    ]
+    canonical_order = sorted(range(len(courses)), key=courses.__getitem__)
+    positions = [0] * len(courses)
+    for position, index in enumerate(canonical_order):
+        positions[index] = position
+    key = json.dumps({
+        "courses": [courses[index] for index in canonical_order],
+        "days": sorted(request_data.get("days", []), key=str),
+        "times": sorted(request_data.get("times", []), key=str),
+        "useAI": bool(request_data.get("useAI", False)),
+        "commutePreference": request_data.get("commutePreference", ""),
+        "topK": top_k,
+        "diverse": bool(request_data.get("diverse", False)),
+    }, sort_keys=True)
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return (snapshot.schedule_fingerprint(), digest), positions
+
+
 @app.route("/api/routine", methods=["POST"])
 def generate_routine():
     try:
-        # Load fresh data for each routine generation request
-        # print("\n=== Loading Fresh Course Data ===")
-        fresh_data = load_data()  # Get fresh data from the API
-        if not fresh_data:
+        # Use the current catalog snapshot
+        snapshot = load_snapshot()
+        if snapshot is None or not snapshot.records:
             return jsonify({"error": "Failed to load current course data"}), 503
         
         # Get request data
@@ -1234,174 +3308,444 @@ def generate_routine():
             times = request_data.get("times", [])
             use_ai = request_data.get("useAI", False)
             commute_preference = request_data.get("commutePreference", "")
-
-            # Get all possible combinations
-            all_combinations = []
-            for course in courses:
-                course_code = course["course"]
-                faculty_list = course["faculty"]
-                sections_by_faculty = course.get("sections", {})
-                
-                # Find all sections for this course
-                course_sections = []
-                
-                # Get all sections for the course
-                available_sections = [s for s in fresh_data if s.get("courseCode") == course_code]
-                
-                if not available_sections:
-                    # print(f"Course not found in fresh data: {course_code}")
-                    return jsonify({"error": f"Course {course_code} not found in available courses"}), 400
-
-                # If no faculty selected, get all sections with available seats
-                if not faculty_list:
-                    # print(f"No faculty selected for {course_code}, getting all available sections")
-                    course_sections = [
-                        section for section in available_sections 
-                        if section.get("capacity", 0) - section.get("consumedSeat", 0) > 0
-                    ]
+            (top_k, diverse), error = routine_options(request_data)
+            if error:
+                return jsonify({"error": error}), 400
+            deadline, error = routine_deadline(request_data)
+            if error:
+                return jsonify({"error": error}), 400
+
+            # Get the candidate sections of every course
+            all_combinations, error = gather_course_sections(snapshot, courses)
+            if error:
+                return jsonify({"error": error}), 400
+
+            # Apply the seat, day and time slot constraints once per section,
+            # then search the combinations depth first, dropping a partial
+            # routine as soon as it has an exam or time conflict
+            candidate_sections, filter_stats = filter_domains(all_combinations, days, times)
+            # Route the request by its size before searching: tiny ones are
+            # checked exhaustively, large ones may go to the process pool and
+            # ones too large to search are turned away
+            search, size_estimate = routine_size_estimate(
+                candidate_sections, snapshot, deadline, top_k, use_ai, diverse
+            )
+            if size_estimate["engine"] is None:
+                return jsonify({
+                    "error": routine_size_error(size_estimate),
+                    "sizeEstimate": size_estimate,
+                    "filterStats": filter_stats,
+                }), 400
+            # An identical request made earlier is answered with the same
+            # routines, as long as all their sections still have seats
+            cache_key, order = routine_cache_key(snapshot, request_data, top_k)
+            cached = _routine_cache.get(cache_key, order, snapshot)
+            if cached is not None:
+                best_combination, ranked, search_stats = cached
+                details = {
+                    "incomplete": False,
+                    "cached": True,
+                    "searchStats": search_stats,
+                    "filterStats": filter_stats,
+                    "sizeEstimate": size_estimate,
+                }
+            else:
+                if size_estimate["engine"] == "parallel":
+                    search = ParallelRoutineSearch(search, snapshot, request_data)
+                ranked = None
+                if diverse:
+                    ranked = search.diverse(
+                        top_k, RoutineScorer(candidate_sections, days, commute_preference)
+                    )
+                    best_combination = ranked[0][1] if ranked else None
+                elif top_k:
+                    ranked = search.best(
+                        top_k, RoutineScorer(candidate_sections, days, commute_preference)
+                    )
+                    best_combination = ranked[0][1] if ranked else None
+                elif use_ai:
+                    # Pick the routine with the fewest ("far") or most campus
+                    # days, keeping the earliest one on ties
+                    best_combination = None
+                    best_key = None
+                    for class_path in search.class_paths():
+                        # Sections of a class have the same days, so only the
+                        # first routine of each combination of classes can win
+                        path = next(search.expand(class_path))
+                        combination = [
+                            sections[index] for sections, index in zip(candidate_sections, path)
+                        ]
+                        days_count = len({
+                            day for record in combination for day, _, _ in record.meetings if day
+                        })
+                        key = (days_count if commute_preference == "far" else -days_count, path)
+                        if best_key is None or key < best_key:
+                            best_combination, best_key = combination, key
                 else:
-                    # Get sections for selected faculty
-                    for faculty in faculty_list:
-                        if faculty in sections_by_faculty:
-                            # If a specific section is selected for this faculty
-                            section_name = sections_by_faculty[faculty]
-                            matching_sections = [
-                                s for s in available_sections 
-                                if s.get("sectionName") == section_name 
-                                and s.get("faculties") == faculty
-                                and s.get("capacity", 0) - s.get("consumedSeat", 0) > 0
-                            ]
-                            course_sections.extend(matching_sections)
-                        else:
-                            # If no specific section is selected, get all sections for this faculty
-                            faculty_sections = [
-                                s for s in available_sections 
-                                if s.get("faculties") == faculty
-                                and s.get("capacity", 0) - s.get("consumedSeat", 0) > 0
-                            ]
-                            course_sections.extend(faculty_sections)
-                
-                if not course_sections:
-                    msg = "No available sections found"
-                    if faculty_list:
-                        msg += " with selected faculty"
-                    msg += f" for {course_code}"
-                    # print(msg)
-                    return jsonify({"error": msg}), 400
-                
-                # print(f"Found {len(course_sections)} sections for {course_code}")
-                all_combinations.append(course_sections)
-
-            if not all_combinations:
-                return jsonify({"error": "No valid sections found for any courses"}), 400
-
-            # Generate all possible combinations
-            try:
-                all_combinations = list(product(*all_combinations))
-                # print(f"Generated {len(all_combinations)} possible combinations")
-            except Exception as e:
-                # print(f"Error generating combinations: {str(e)}")
-                return jsonify({"error": "Failed to generate valid combinations. Please check your course selections."}), 400
-
-            if not all_combinations:
-                return jsonify({"error": "No valid combinations could be generated"}), 400
-
-            # STEP 1: Check exam conflicts
-            # print("\n=== STEP 1: Checking Exam Conflicts ===")
-            combinations_without_exam_conflicts = []
-            for combination in all_combinations:
-                # Validate combination structure
-                if not all(isinstance(section, dict) and "courseCode" in section for section in combination):
-                    # print("Invalid section found in combination, skipping...")
-                    continue
+                    best_combination = search.first()
+                # When the time budget ran out, the result is the best found so far
+                details = {
+                    "incomplete": search.timed_out,
+                    "searchStats": search.stats(),
+                    "filterStats": filter_stats,
+                    "sizeEstimate": size_estimate,
+                }
+                if best_combination is not None and not search.timed_out:
+                    _routine_cache.put(
+                        cache_key, order, snapshot, best_combination, ranked, details["searchStats"]
+                    )
 
-                has_exam_conflicts, exam_error = check_exam_compatibility(combination)
-                if has_exam_conflicts:
+            if best_combination is None:
+                timeout_error = (
+                    "Could not find a routine within the time limit. "
+                    "Try fewer courses or narrower preferences."
+                )
+                if search.timed_out:
+                    return jsonify({"error": timeout_error, **details}), 200
+                # Report the first check that rules out every combination,
+                # looking only at the sections with seats
+                open_sections = [
+                    [record for record in sections if record.available_seats > 0]
+                    for sections in all_combinations
+                ]
+                exam_search = RoutineSearch(
+                    open_sections, check_times=False, deadline=deadline, snapshot=snapshot
+                )
+                if exam_search.first() is None:
+                    if exam_search.timed_out:
+                        return jsonify({"error": timeout_error, **details}), 200
+                    # Every combination has an exam conflict, including the first
+                    combination = [sections[0] for sections in open_sections]
+                    _, exam_error = check_exam_compatibility(
+                        [record.raw for record in combination]
+                    )
                     # print(f"✗ Exam conflict found: {exam_error}")
                     # Format the error message for the frontend's ExamConflictMessage component
-                    affected_courses = [section["courseCode"] for section in combination]
+                    affected_courses = [record.course_code for record in combination]
                     error_msg = f"Exam Conflicts\nAffected Courses: {', '.join(affected_courses)}\n{exam_error}"
-                    return jsonify({"error": error_msg}), 200
-                combinations_without_exam_conflicts.append(combination)
-
-            if not combinations_without_exam_conflicts:
-                return jsonify({"error": "No valid combinations found without exam conflicts"}), 200
-
-            # STEP 2: Check time conflicts
-            valid_combinations = []
-            for combination in combinations_without_exam_conflicts:
-                if is_valid_combination(combination):
-                    valid_combinations.append(combination)
-
-            if not valid_combinations:
-                return jsonify({"error": "No valid combinations found without time conflicts"}), 200
-
-            # STEP 3: Check day/time preferences
-            final_combinations = []
-            for combination in valid_combinations:
-                all_sections_valid = True
-                for section in combination:
-                    # Check if section schedules fit within selected times
-                    valid_time, _ = filter_section_by_time(section, times)
-                    if not valid_time:
-                        all_sections_valid = False
-                        break
+                    return jsonify({"error": error_msg, **details}), 200
+                time_search = RoutineSearch(open_sections, deadline=deadline, snapshot=snapshot)
+                if time_search.first() is None:
+                    if time_search.timed_out:
+                        return jsonify({"error": timeout_error, **details}), 200
+                    return jsonify({
+                        "error": "No valid combinations found without time conflicts",
+                        **details,
+                    }), 200
+                return jsonify({
+                    "error": "No combinations found that match your day and time preferences",
+                    **details,
+                }), 200
+
+            best_combination = [record.raw for record in best_combination]
+            if diverse:
+                # How far each routine is from the closest one before it
+                profiles = [routine_profile(combination) for _, combination in ranked]
+                routines = []
+                for i, (score, combination) in enumerate(ranked):
+                    raw = [record.raw for record in combination]
+                    routines.append({
+                        "routine": raw,
+                        "score": score,
+                        "distance": min(
+                            (routine_distance(profiles[i], profile) for profile in profiles[:i]),
+                            default=None,
+                        ),
+                        "campusDays": calculate_campus_days(raw)[1],
+                    })
+                return jsonify({"routine": best_combination, "routines": routines, **details}), 200
+            if ranked is not None:
+                return jsonify({
+                    "routine": best_combination,
+                    "routines": [
+                        {"routine": [record.raw for record in combination], "score": score}
+                        for score, combination in ranked
+                    ],
+                    **details,
+                }), 200
+            if use_ai:
+                return try_ai_routine_generation(
+                    best_combination, days, times, commute_preference, details
+                )
 
-                    # Check if section days are in selected days
-                    section_days = set()
-                    if section.get("sectionSchedule") and section["sectionSchedule"].get("classSchedules"):
-                        section_days.update(schedule["day"].upper() 
-                            for schedule in section["sectionSchedule"]["classSchedules"])
-                    for lab in get_lab_schedules_flat(section):
-                        section_days.add(lab["day"].upper())
-                    
-                    if not all(day.upper() in [d.upper() for d in days] for day in section_days):
-                        all_sections_valid = False
-                        break
+            # Return the first valid combination
+            return jsonify({"routine": best_combination, **details}), 200
 
-                if all_sections_valid:
-                    final_combinations.append(combination)
+    except Exception as e:
+        # print(f"Error in generate_routine: {str(e)}")
+        traceback.print_exc()  # Print full traceback for debugging
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
-            if not final_combinations:
-                return jsonify({"error": "No combinations found that match your day and time preferences"}), 200
+# Routines per page of /api/routines, and the most one page may hold
+ROUTINE_PAGE_SIZE = 10
+ROUTINE_MAX_PAGE_SIZE = 50
 
-            # If using AI, pass to AI routine generation
-            if use_ai:
-                # Sort combinations by campus days based on commute preference
-                combinations_with_days = []
-                for combination in final_combinations:
-                    days_count, days_list = calculate_campus_days(combination)
-                    combinations_with_days.append({
-                        "combination": combination,
-                        "campus_days": days_count,
-                        "days_list": days_list
-                    })
 
-                # Sort based on commute preference
-                if commute_preference == "far":
-                    # For "Live Far", sort by ascending campus days (fewer days is better)
-                    combinations_with_days.sort(key=lambda x: x["campus_days"])
-                else:
-                    # For "Live Near" or no preference, sort by descending campus days (more days is better)
-                    combinations_with_days.sort(key=lambda x: x["campus_days"], reverse=True)
+def routine_request_hash(request_data):
+    """Short hash of the request fields that define the routine search."""
+    key = {field: request_data.get(field) for field in ("courses", "days", "times")}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
 
-                # Use the best combination
-                best_combination = combinations_with_days[0]["combination"]
-                return try_ai_routine_generation(best_combination, days, times, commute_preference)
 
-            # Return the first valid combination
-            return jsonify({"routine": final_combinations[0]}), 200
+def routine_domains_hash(domains):
+    """Short hash of the candidate sections and their schedules, in search order.
+
+    It only depends on the course data, so every instance serving the same
+    data agrees on it, and any change that could move a cursor's position
+    (sections added, removed or rescheduled) changes it."""
+    digest = hashlib.sha256()
+    for domain in domains:
+        for record in domain:
+            digest.update(repr((
+                record.section_id,
+                record.class_meetings,
+                record.lab_meetings,
+                record.mid_exam,
+                record.final_exam,
+            )).encode())
+        digest.update(b"|")
+    return digest.hexdigest()[:16]
+
+
+def encode_routine_cursor(domains_hash, request_hash, path, inclusive=False):
+    payload = json.dumps([domains_hash, request_hash, list(path), inclusive], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_routine_cursor(cursor):
+    """Return (domains_hash, request_hash, path, inclusive) from a cursor, or None if it is malformed."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        domains_hash, request_hash, path, inclusive = json.loads(payload)
+    except (TypeError, ValueError):
+        return None
+    if (
+        isinstance(domains_hash, str)
+        and isinstance(request_hash, str)
+        and isinstance(path, list)
+        and all(type(index) is int and index >= 0 for index in path)
+        and isinstance(inclusive, bool)
+    ):
+        return domains_hash, request_hash, tuple(path), inclusive
+    return None
+
+
+@app.route("/api/routines", methods=["POST"])
+def page_routines():
+    """Return valid routines a page at a time.
+
+    Takes the same body as /api/routine plus an optional "pageSize" and,
+    for every page after the first, the "cursor" returned with the previous
+    one. The cursor holds the search position, a hash of the candidate
+    sections and a hash of the request, so the next page picks up where the
+    last stopped, on whichever instance serves it.
+    A null cursor means there are no more routines. A page cut short by the
+    time budget is marked incomplete and still returns a cursor."""
+    try:
+        snapshot = load_snapshot()
+        if snapshot is None or not snapshot.records:
+            return jsonify({"error": "Failed to load current course data"}), 503
+
+        request_data = request.get_json(silent=True)
+        if not request_data or "courses" not in request_data:
+            return jsonify({"error": "No data provided"}), 400
+        days = request_data.get("days", [])
+        times = request_data.get("times", [])
+
+        page_size = request_data.get("pageSize", ROUTINE_PAGE_SIZE)
+        if isinstance(page_size, bool) or not isinstance(page_size, int) or page_size < 1:
+            return jsonify({"error": "pageSize must be a positive integer"}), 400
+        page_size = min(page_size, ROUTINE_MAX_PAGE_SIZE)
+        deadline, error = routine_deadline(request_data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        request_hash = routine_request_hash(request_data)
+        decoded = None
+        if request_data.get("cursor") is not None:
+            cursor = request_data["cursor"]
+            decoded = decode_routine_cursor(cursor) if isinstance(cursor, str) else None
+            if decoded is None or decoded[1] != request_hash:
+                return jsonify({"error": "Invalid cursor for this request"}), 400
+
+        all_combinations, error = gather_course_sections(snapshot, request_data["courses"])
+        if error:
+            return jsonify({"error": error}), 400
+        candidate_sections, filter_stats = filter_domains(all_combinations, days, times)
+
+        # Courses with the fewest candidates are assigned first. The order
+        # only depends on the request, so every page walks the same tree.
+        order = sorted(range(len(candidate_sections)), key=lambda d: (len(candidate_sections[d]), d))
+        domains_hash = routine_domains_hash([candidate_sections[d] for d in order])
+        after = None
+        inclusive = False
+        if decoded is not None:
+            if decoded[0] != domains_hash:
+                return jsonify({
+                    "error": "Course data has changed since the previous page. Please start again."
+                }), 409
+            after, inclusive = decoded[2], decoded[3]
+            if len(after) != len(order) or any(
+                index >= len(candidate_sections[d]) for d, index in zip(order, after)
+            ):
+                return jsonify({"error": "Invalid cursor for this request"}), 400
+        search = RoutineSearch(
+            [candidate_sections[d] for d in order],
+            most_constrained_first=False,
+            deadline=deadline,
+            group_equivalent=False,
+            snapshot=snapshot,
+        )
+        routines = []
+        last_path = None
+        for path in search.paths(after=after, inclusive=inclusive):
+            routine = [None] * len(order)
+            for d, index in zip(order, path):
+                routine[d] = candidate_sections[d][index].raw
+            routines.append(routine)
+            last_path = path
+            if len(routines) == page_size:
+                break
+
+        # A full page may be followed by more routines; a short one is the
+        # last, unless the search ran out of time before finishing it
+        next_cursor = None
+        if search.timed_out:
+            resume_after, resume_inclusive = search.resume_from
+            next_cursor = encode_routine_cursor(
+                domains_hash, request_hash, resume_after, resume_inclusive
+            )
+        elif len(routines) == page_size:
+            next_cursor = encode_routine_cursor(domains_hash, request_hash, last_path)
+        return jsonify({
+            "routines": routines,
+            "cursor": next_cursor,
+            "incomplete": search.timed_out,
+            "searchStats": search.stats(),
+            "filterStats": filter_stats,
+        }), 200
 
     except Exception as e:
-        # print(f"Error in generate_routine: {str(e)}")
-        traceback.print_exc()  # Print full traceback for debugging
+        # print(f"Error in page_routines: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+# Share of a count request's time budget spent trying to count exactly,
+# before falling back to an estimate
+ROUTINE_COUNT_EXACT_SHARE = 0.75
+# Fewest probes whose spread is trusted for a confidence interval; with fewer
+# (a tight budget or slow probes) the interval is left out
+ROUTINE_COUNT_MIN_INTERVAL_SAMPLES = 30
+
+
+@app.route("/api/routines/count", methods=["POST"])
+def count_routines():
+    """Return how many valid routines there are for a request.
+
+    Takes the same body as /api/routine. The count is exact when it can be
+    worked out within the time budget; otherwise "exact" is false and the
+    count is an estimate with a 95% "confidenceInterval", which is null when
+    there were too few samples to work one out."""
+    try:
+        snapshot = load_snapshot()
+        if snapshot is None or not snapshot.records:
+            return jsonify({"error": "Failed to load current course data"}), 503
+
+        request_data = request.get_json(silent=True)
+        if not request_data or "courses" not in request_data:
+            return jsonify({"error": "No data provided"}), 400
+        days = request_data.get("days", [])
+        times = request_data.get("times", [])
+        deadline, error = routine_deadline(request_data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        all_combinations, error = gather_course_sections(snapshot, request_data["courses"])
+        if error:
+            return jsonify({"error": error}), 400
+        candidate_sections, filter_stats = filter_domains(all_combinations, days, times)
+        start = time.monotonic()
+        search = RoutineSearch(
+            candidate_sections,
+            deadline=start + (deadline - start) * ROUTINE_COUNT_EXACT_SHARE,
+            snapshot=snapshot,
+        )
+        count = search.count()
+        if count is not None:
+            result = {"count": count, "exact": True}
+        else:
+            # A fixed seed gives the same estimate for the same probes
+            estimate, margin, samples = search.estimate_count(deadline, random.Random(0))
+            interval = None
+            if samples >= ROUTINE_COUNT_MIN_INTERVAL_SAMPLES:
+                interval = [max(0, math.floor(estimate - margin)), math.ceil(estimate + margin)]
+            result = {
+                "count": round(estimate),
+                "exact": False,
+                "confidenceInterval": interval,
+                "samples": samples,
+            }
+        return jsonify({**result, "searchStats": search.stats(), "filterStats": filter_stats}), 200
+
+    except Exception as e:
+        # print(f"Error in count_routines: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+@app.route("/api/routines/estimate", methods=["POST"])
+def estimate_routines():
+    """Return the size estimate /api/routine works out before searching.
+
+    Takes the same body as /api/routine. A request /api/routine would turn
+    away has "engine" null and an "error" saying why."""
+    try:
+        snapshot = load_snapshot()
+        if snapshot is None or not snapshot.records:
+            return jsonify({"error": "Failed to load current course data"}), 503
+
+        request_data = request.get_json(silent=True)
+        if not request_data or "courses" not in request_data:
+            return jsonify({"error": "No data provided"}), 400
+        (top_k, diverse), error = routine_options(request_data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        all_combinations, error = gather_course_sections(snapshot, request_data["courses"])
+        if error:
+            return jsonify({"error": error}), 400
+        candidate_sections, filter_stats = filter_domains(
+            all_combinations, request_data.get("days", []), request_data.get("times", [])
+        )
+        _, size_estimate = routine_size_estimate(
+            candidate_sections,
+            snapshot,
+            None,
+            top_k,
+            request_data.get("useAI", False),
+            diverse,
+        )
+        result = {"sizeEstimate": size_estimate, "filterStats": filter_stats}
+        if size_estimate["engine"] is None:
+            result["error"] = routine_size_error(size_estimate)
+        return jsonify(result), 200
+
+    except Exception as e:
+        # print(f"Error in estimate_routines: {str(e)}")
+        traceback.print_exc()
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
-def try_ai_routine_generation(valid_combination, selected_days, selected_times, commute_preference):
+
+def try_ai_routine_generation(valid_combination, selected_days, selected_times, commute_preference,
+                               details=None):
     """AI-assisted routine generation using Gemini AI."""
     try:
         # print("\n=== AI Routine Generation with Gemini ===")
 
+        # Work on copies so the shared snapshot is not modified
+        valid_combination = [dict(section) for section in valid_combination]
+
         # Format the schedules for the response
         for section in valid_combination:
             section_schedules = []
@@ -1445,7 +3789,8 @@ def try_ai_routine_generation(valid_combination, selected_days, selected_times,
 
         # Always include feedback in the response
         feedback = get_routine_feedback_for_api(valid_combination, commute_preference)
-        return jsonify({"routine": valid_combination, "feedback": feedback}), 200
+        # details: search statistics to pass along with the routine
+        return jsonify({"routine": valid_combination, "feedback": feedback, **(details or {})}), 200
 
     except Exception as e:
         # print(f"Error in AI routine generation: {e}")
@@ -1466,24 +3811,15 @@ def auto_fix_json(s):
 
 def format24(time_str):
     # Converts "8:00 AM" to "08:00:00"
-    try:
-        dt = datetime.strptime(time_str.strip(), "%I:%M %p")
-        return dt.strftime("%H:%M:%S")
-    except Exception:
+    minutes = parse_time_minutes(time_str)
+    if minutes is None:
         return time_str
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
 
 
 def timeToMinutes(tstr):
     # Accepts "08:00:00" or "8:00 AM"
-    tstr = tstr.strip()
-    try:
-        if "AM" in tstr or "PM" in tstr:
-            dt = datetime.strptime(tstr, "%I:%M %p")
-        else:
-            dt = datetime.strptime(tstr, "%H:%M:%S")
-        return dt.hour * 60 + dt.minute
-    except Exception:
-        return 0
+    return TimeUtils.time_to_minutes(tstr)
 
 
 @app.route("/api/ask_ai", methods=["POST"])
@@ -1668,20 +4004,25 @@ def check_time_conflicts_ai():
         if not routine:
             return jsonify({"error": "No routine provided for analysis"}), 400
 
-        # Check for time conflicts
+        # Check for time conflicts. Sections whose weekly masks do not
+        # intersect cannot clash, so only the other pairs are compared
+        # meeting by meeting
         time_conflicts = []
+        masks = [section_time_mask(section) for section in routine]
+
+        def class_schedules(section):
+            return (section.get("sectionSchedule") or {}).get("classSchedules") or []
+
         for i in range(len(routine)):
             section1 = routine[i]
             for j in range(i + 1, len(routine)):
                 section2 = routine[j]
+                if masks[i] is not None and masks[j] is not None and not masks[i] & masks[j]:
+                    continue
 
                 # Check class schedules
-                for sched1 in section1.get("sectionSchedule", {}).get(
-                    "classSchedules", []
-                ):
-                    for sched2 in section2.get("sectionSchedule", {}).get(
-                        "classSchedules", []
-                    ):
+                for sched1 in class_schedules(section1):
+                    for sched2 in class_schedules(section2):
                         if sched1.get("day") == sched2.get("day"):
                             start1 = TimeUtils.time_to_minutes(sched1.get("startTime"))
                             end1 = TimeUtils.time_to_minutes(sched1.get("endTime"))
@@ -1701,8 +4042,8 @@ def check_time_conflicts_ai():
                                 )
 
                 # Check lab schedules
-                for lab1 in section1.get("labSchedules", []):
-                    for lab2 in section2.get("labSchedules", []):
+                for lab1 in get_lab_schedules_flat(section1):
+                    for lab2 in get_lab_schedules_flat(section2):
                         if lab1.get("day") == lab2.get("day"):
                             start1 = TimeUtils.time_to_minutes(lab1.get("startTime"))
                             end1 = TimeUtils.time_to_minutes(lab1.get("endTime"))
@@ -1723,10 +4064,8 @@ def check_time_conflicts_ai():
 
                 # Check lab-class and class-lab conflicts
                 # Lab in section1 vs Class in section2
-                for lab1 in section1.get("labSchedules", []):
-                    for sched2 in section2.get("sectionSchedule", {}).get(
-                        "classSchedules", []
-                    ):
+                for lab1 in get_lab_schedules_flat(section1):
+                    for sched2 in class_schedules(section2):
                         if lab1.get("day") == sched2.get("day"):
                             start1 = TimeUtils.time_to_minutes(lab1.get("startTime"))
                             end1 = TimeUtils.time_to_minutes(lab1.get("endTime"))
@@ -1745,10 +4084,8 @@ def check_time_conflicts_ai():
                                     }
                                 )
                 # Class in section1 vs Lab in section2
-                for sched1 in section1.get("sectionSchedule", {}).get(
-                    "classSchedules", []
-                ):
-                    for lab2 in section2.get("labSchedules", []):
+                for sched1 in class_schedules(section1):
+                    for lab2 in get_lab_schedules_flat(section2):
                         if sched1.get("day") == lab2.get("day"):
                             start1 = TimeUtils.time_to_minutes(sched1.get("startTime"))
                             end1 = TimeUtils.time_to_minutes(sched1.get("endTime"))
@@ -1830,24 +4167,27 @@ def get_exam_schedule():
     if not course_code or not section_name:
         return jsonify({"error": "Missing courseCode or sectionName"}), 400
 
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return jsonify({"error": "Failed to load course data. Please try again later."}), 503
+
     # Find the section in the data
-    for section in data:
-        if section.get("courseCode") == course_code and str(
-            section.get("sectionName")
-        ) == str(section_name):
-            # Return only the exam fields
-            return jsonify(
-                {
-                    "courseCode": section.get("courseCode"),
-                    "sectionName": section.get("sectionName"),
-                    "midExamDate": section.get("midExamDate"),
-                    "midExamStartTime": section.get("midExamStartTime"),
-                    "midExamEndTime": section.get("midExamEndTime"),
-                    "finalExamDate": section.get("finalExamDate"),
-                    "finalExamStartTime": section.get("finalExamStartTime"),
-                    "finalExamEndTime": section.get("finalExamEndTime"),
-                }
-            )
+    records = snapshot.by_course_section.get((course_code, str(section_name)))
+    if records:
+        section = records[0].raw
+        # Return only the exam fields
+        return jsonify(
+            {
+                "courseCode": section.get("courseCode"),
+                "sectionName": section.get("sectionName"),
+                "midExamDate": section.get("midExamDate"),
+                "midExamStartTime": section.get("midExamStartTime"),
+                "midExamEndTime": section.get("midExamEndTime"),
+                "finalExamDate": section.get("finalExamDate"),
+                "finalExamStartTime": section.get("finalExamStartTime"),
+                "finalExamEndTime": section.get("finalExamEndTime"),
+            }
+        )
     return jsonify({"error": "Section not found"}), 404
 
 
@@ -1952,6 +4292,225 @@ def calculate_routine_score(
     return score
 
 
+class RoutineScorer:
+    """calculate_routine_score() over a RoutineSearch's domains, with bounds.
+
+    score(path) gives the same value as calculate_routine_score() on the
+    routine's sections, but from the meetings parsed at ingest. bound()
+    gives an upper bound on the score of any routine that completes a
+    partial assignment, for branch-and-bound:
+
+    - the day balance uses the least spread the remaining courses could
+      still reach, with each adding at most its busiest section per day;
+    - gap penalties are never positive, so they are bounded by 0;
+    - early/late class counts and campus days can only grow, up to what
+      the remaining courses could add."""
+
+    def __init__(self, domains, selected_days, commute_preference):
+        self.domains = domains
+        self.days = list(dict.fromkeys(selected_days))
+        self.day_count = len(selected_days)
+        self.commute_preference = commute_preference
+        day_index = {day: i for i, day in enumerate(self.days)}
+        # (domain, index) -> (meetings per selected day, early, late, meetings
+        # on selected days as (day, start, end))
+        self.features = []
+        # Per domain: most meetings any section has on each day, and the
+        # most early and late classes of any section
+        self.most = []
+        for sections in domains:
+            features = []
+            most_per_day = [0] * len(self.days)
+            most_early = most_late = 0
+            for record in sections:
+                per_day = [0] * len(self.days)
+                early = late = 0
+                meetings = []
+                for day, start, end in record.meetings:
+                    i = day_index.get(day)
+                    if i is None:
+                        continue
+                    per_day[i] += 1
+                    early += start < 540  # Before 9:00 AM
+                    late += end > 960  # After 4:00 PM
+                    meetings.append((i, start, end))
+                features.append((per_day, early, late, meetings))
+                most_per_day = [max(a, b) for a, b in zip(most_per_day, per_day)]
+                most_early = max(most_early, early)
+                most_late = max(most_late, late)
+            self.features.append(features)
+            self.most.append((most_per_day, most_early, most_late))
+
+    def _totals(self, items):
+        per_day = [0] * len(self.days)
+        early = late = 0
+        for d, index in items:
+            section_per_day, section_early, section_late, _ = self.features[d][index]
+            per_day = [a + b for a, b in zip(per_day, section_per_day)]
+            early += section_early
+            late += section_late
+        return per_day, early, late
+
+    def _timing_score(self, early_low, early_high, late_low, late_high):
+        # Best timing score for early/late counts within the given ranges
+        if self.commute_preference == "early":
+            return (5 - late_low) * 2
+        if self.commute_preference == "late":
+            return (5 - early_low) * 2
+        return -max(0, early_low - late_high, late_low - early_high) * 2
+
+    def _days_score(self, days_on_campus):
+        if self.commute_preference == "far":
+            return (self.day_count - days_on_campus) * 10
+        if self.commute_preference == "near":
+            if days_on_campus == self.day_count:
+                return 1000
+            return -(self.day_count - days_on_campus) * 50
+        return 0
+
+    def score(self, path):
+        per_day, early, late = self._totals(enumerate(path))
+        score = -(max(per_day) - min(per_day)) * 2 if per_day else 0
+        schedules = [[] for _ in self.days]
+        for d, index in enumerate(path):
+            for i, start, end in self.features[d][index][3]:
+                schedules[i].append((start, end))
+        gaps = []
+        for day_schedules in schedules:
+            day_schedules.sort(key=lambda x: x[0])
+            for (_, end), (start, _) in zip(day_schedules, day_schedules[1:]):
+                if start - end > 30:
+                    gaps.append(start - end)
+        if gaps:
+            score += -(sum(gaps) / len(gaps)) / 60
+        score += self._timing_score(early, early, late, late)
+        score += self._days_score(sum(1 for count in per_day if count))
+        return score
+
+    def bound(self, chosen, unassigned):
+        unassigned = set(unassigned)
+        per_day, early, late = self._totals(
+            (d, index) for d, index in enumerate(chosen) if d not in unassigned
+        )
+        reach = list(per_day)
+        early_reach, late_reach = early, late
+        for d in unassigned:
+            most_per_day, most_early, most_late = self.most[d]
+            reach = [a + b for a, b in zip(reach, most_per_day)]
+            early_reach += most_early
+            late_reach += most_late
+        bound = -max(0, max(per_day) - min(reach)) * 2 if per_day else 0
+        bound += self._timing_score(early, early_reach, late, late_reach)
+        if self.commute_preference == "far":
+            bound += self._days_score(sum(1 for count in per_day if count))
+        else:
+            bound += self._days_score(sum(1 for count in reach if count))
+        return bound
+
+
+def section_profile(record):
+    """Campus days and TIME_SLOTS of a section's meetings, as bitmasks."""
+    days = slots = 0
+    for day, start, end in record.meetings:
+        if day in WEEKDAY_INDEX:
+            days |= 1 << WEEKDAY_INDEX[day]
+        for i, (slot_start, slot_end) in enumerate(TIME_SLOT_RANGES.values()):
+            if start < slot_end and end > slot_start:
+                slots |= 1 << i
+    return days, slots
+
+
+def routine_profile(combination):
+    """(campus days, time slots, faculty per course) of a routine, for routine_distance()."""
+    days = slots = 0
+    for record in combination:
+        section_days, section_slots = section_profile(record)
+        days |= section_days
+        slots |= section_slots
+    return days, slots, tuple(record.faculty for record in combination)
+
+
+def jaccard_distance(bits, other_bits, union_bits):
+    union = bin(union_bits).count("1")
+    return 1 - bin(bits & other_bits).count("1") / union if union else 0.0
+
+
+def routine_distance(profile, other):
+    """How different two routines are, from 0 to 1.
+
+    The average of how far apart their campus days are, as in
+    calculate_campus_days(), how far apart their time slots are, and the
+    share of courses they take with a different faculty."""
+    days, slots, faculties = profile
+    other_days, other_slots, other_faculties = other
+    differ = sum(1 for a, b in zip(faculties, other_faculties) if a != b)
+    return (
+        jaccard_distance(days, other_days, days | other_days)
+        + jaccard_distance(slots, other_slots, slots | other_slots)
+        + (differ / len(faculties) if faculties else 0.0)
+    ) / 3
+
+
+class DiverseRoutineScorer:
+    """Ranks routines by routine_distance() from the closest of the routines
+    picked so far, then by a RoutineScorer, for RoutineSearch.diverse().
+
+    score(path) and bound() give (distance, score) pairs. The distance
+    bound holds because campus days and time slots only grow as courses
+    are assigned, up to what the remaining courses could add, and every
+    remaining course may still change faculty."""
+
+    def __init__(self, scorer, domains, picked):
+        self.scorer = scorer
+        self.domains = domains
+        self.profiles = [[section_profile(record) for record in sections] for sections in domains]
+        # Per domain, every campus day and time slot its sections could add
+        self.reach = []
+        for profiles in self.profiles:
+            days = slots = 0
+            for section_days, section_slots in profiles:
+                days |= section_days
+                slots |= section_slots
+            self.reach.append((days, slots))
+        self.picked = [
+            routine_profile([sections[index] for sections, index in zip(domains, path)])
+            for path in picked
+        ]
+
+    def score(self, path):
+        profile = routine_profile([sections[index] for sections, index in zip(self.domains, path)])
+        distance = min(routine_distance(profile, picked) for picked in self.picked)
+        # Rounded so that equally far routines are ranked by score
+        return round(distance, 6), self.scorer.score(path)
+
+    def bound(self, chosen, unassigned):
+        unassigned = set(unassigned)
+        days = slots = 0
+        for d, index in enumerate(chosen):
+            if d not in unassigned:
+                section_days, section_slots = self.profiles[d][index]
+                days |= section_days
+                slots |= section_slots
+        reach_days, reach_slots = days, slots
+        for d in unassigned:
+            reach_days |= self.reach[d][0]
+            reach_slots |= self.reach[d][1]
+        distance = None
+        for picked_days, picked_slots, picked_faculties in self.picked:
+            differ = len(unassigned) + sum(
+                1
+                for d, index in enumerate(chosen)
+                if d not in unassigned and self.domains[d][index].faculty != picked_faculties[d]
+            )
+            bound = (
+                jaccard_distance(days, picked_days, reach_days | picked_days)
+                + jaccard_distance(slots, picked_slots, reach_slots | picked_slots)
+                + differ / len(self.domains)
+            ) / 3
+            distance = bound if distance is None else min(distance, bound)
+        return round(distance, 6), self.scorer.bound(chosen, unassigned)
+
+
 def get_routine_feedback_for_api(routine, commute_preference=None):
     try:
         import google.generativeai as genai
@@ -2102,29 +4661,6 @@ def get_lab_schedules_flat(section):
     return []
 
 
-def convert_time_24_to_12(time_str):
-    """Convert 24-hour time string to 12-hour format."""
-    try:
-        # Split the time range
-        start_time, end_time = time_str.split(" - ")
-        
-        # Convert each time
-        start_dt = datetime.strptime(start_time.strip(), "%H:%M:%S")
-        end_dt = datetime.strptime(end_time.strip(), "%H:%M:%S")
-        
-        # Format to 12-hour
-        start_12 = start_dt.strftime("%I:%M %p")
-        end_12 = end_dt.strftime("%I:%M %p")
-        
-        # Remove leading zeros and format
-        start_12 = start_12.lstrip("0")
-        end_12 = end_12.lstrip("0")
-        
-        return f"{start_12} - {end_12}"
-    except Exception as e:
-        # print(f"Error converting time: {e}")
-        return time_str
-
 def format_section_times(section):
     """Format all time fields in a section."""
     try: